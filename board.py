@@ -1,40 +1,218 @@
+import os
 import random
-import copy
+import time
+
+import log
+
+# Internal board is a 0x88 array: square = row * 16 + col, so a square is off the
+# board exactly when it has a bit of 0x88 set. Pieces are small ints, BLACK marks colour.
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+BLACK = 8
+
+KNIGHT_DELTAS = (33, 31, -31, -33, 18, 14, -14, -18)
+BISHOP_DELTAS = (17, 15, -15, -17)
+ROOK_DELTAS = (16, -16, 1, -1)
+KING_DELTAS = (17, 15, -15, -17, 16, -16, 1, -1)
+QUEEN_DELTAS = KING_DELTAS
+
+SQUARES = tuple(sq for sq in range(128) if not sq & 0x88)
+
+# Move tables indexed by 0x88 square, built once at import so the generators never do delta
+# arithmetic or bounds checks: target squares for knights and kings, capture squares for pawns
+# ([white, black]) and, for sliders, one tuple of squares per direction ordered outwards.
+def _targets(sq, deltas):
+    return tuple(sq + delta for delta in deltas if not (sq + delta) & 0x88)
+
+def _rays(sq, deltas):
+    rays = []
+    for delta in deltas:
+        ray = []
+        to = sq + delta
+        while not to & 0x88:
+            ray.append(to)
+            to += delta
+        if ray:
+            rays.append(tuple(ray))
+    return tuple(rays)
+
+_tables_start = time.perf_counter()
+KNIGHT_TARGETS = [()] * 128
+KING_TARGETS = [()] * 128
+PAWN_CAPTURES = ([()] * 128, [()] * 128)
+BISHOP_RAYS = [()] * 128
+ROOK_RAYS = [()] * 128
+QUEEN_RAYS = [()] * 128
+for _sq in SQUARES:
+    KNIGHT_TARGETS[_sq] = _targets(_sq, KNIGHT_DELTAS)
+    KING_TARGETS[_sq] = _targets(_sq, KING_DELTAS)
+    PAWN_CAPTURES[0][_sq] = _targets(_sq, (-17, -15))
+    PAWN_CAPTURES[1][_sq] = _targets(_sq, (15, 17))
+    BISHOP_RAYS[_sq] = _rays(_sq, BISHOP_DELTAS)
+    ROOK_RAYS[_sq] = _rays(_sq, ROOK_DELTAS)
+    QUEEN_RAYS[_sq] = BISHOP_RAYS[_sq] + ROOK_RAYS[_sq]
+SLIDER_RAYS = (None, None, None, BISHOP_RAYS, ROOK_RAYS, QUEEN_RAYS)
+TABLES_BUILD_SECONDS = time.perf_counter() - _tables_start
+
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+
+# castling rights that survive a move touching the square
+CASTLING_MASK = [15] * 128
+CASTLING_MASK[0x74] = 15 & ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASK[0x77] = 15 & ~WHITE_KING_SIDE
+CASTLING_MASK[0x70] = 15 & ~WHITE_QUEEN_SIDE
+CASTLING_MASK[0x04] = 15 & ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASK[0x07] = 15 & ~BLACK_KING_SIDE
+CASTLING_MASK[0x00] = 15 & ~BLACK_QUEEN_SIDE
+# the piece each castling right needs on its home square (the mask above clears the rights it backs)
+CASTLING_HOMES = ((0x74, KING), (0x77, ROOK), (0x70, ROOK), (0x04, KING | BLACK), (0x07, ROOK | BLACK), (0x00, ROOK | BLACK))
+
+# Zobrist keys, seeded so a position hashes the same in every process and every run.
+# Pieces are indexed by piece code << 7 | square.
+_zobrist_random = random.Random(0x2BD1E5)
+ZOBRIST_PIECES = [_zobrist_random.getrandbits(64) for _ in range(16 * 128)]
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)
+
+# centipawn values indexed by piece kind (PAWN .. KING)
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 0)
+
+# Piece-square bonuses for white, indexed by piece kind then by row * 8 + col (row 0 is the 8th
+# rank, as on the board). Black uses the same tables mirrored vertically.
+PIECE_SQUARE_TABLES = (
+    None,
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+     5, 5, 10, 25, 25, 10, 5, 5,
+     0, 0, 0, 20, 20, 0, 0, 0,
+     5, -5, -10, 0, 0, -10, -5, 5,
+     5, 10, 10, -20, -20, 10, 10, 5,
+     0, 0, 0, 0, 0, 0, 0, 0),
+    (-50, -40, -30, -30, -30, -30, -40, -50,
+     -40, -20, 0, 0, 0, 0, -20, -40,
+     -30, 0, 10, 15, 15, 10, 0, -30,
+     -30, 5, 15, 20, 20, 15, 5, -30,
+     -30, 0, 15, 20, 20, 15, 0, -30,
+     -30, 5, 10, 15, 15, 10, 5, -30,
+     -40, -20, 0, 5, 5, 0, -20, -40,
+     -50, -40, -30, -30, -30, -30, -40, -50),
+    (-20, -10, -10, -10, -10, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 10, 10, 5, 0, -10,
+     -10, 5, 5, 10, 10, 5, 5, -10,
+     -10, 0, 10, 10, 10, 10, 0, -10,
+     -10, 10, 10, 10, 10, 10, 10, -10,
+     -10, 5, 0, 0, 0, 0, 5, -10,
+     -20, -10, -10, -10, -10, -10, -10, -20),
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     5, 10, 10, 10, 10, 10, 10, 5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     0, 0, 0, 5, 5, 0, 0, 0),
+    (-20, -10, -10, -5, -5, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 5, 5, 5, 0, -10,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     0, 0, 5, 5, 5, 5, 0, -5,
+     -10, 5, 5, 5, 5, 5, 0, -10,
+     -10, 0, 5, 0, 0, 0, 0, -10,
+     -20, -10, -10, -5, -5, -10, -10, -20),
+    (-30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -20, -30, -30, -40, -40, -30, -30, -20,
+     -10, -20, -20, -20, -20, -20, -20, -10,
+     20, 20, 0, 0, 0, 0, 20, 20,
+     20, 30, 10, 0, 0, 10, 30, 20),
+)
+
+# The same bonus for every piece code on every 0x88 square, from the piece owner's point of view:
+# indexed by piece code << 7 | square, like the Zobrist table.
+SQUARE_BONUS = [0] * (16 * 128)
+for _sq in SQUARES:
+    for _kind in range(1, 7):
+        SQUARE_BONUS[_kind << 7 | _sq] = PIECE_SQUARE_TABLES[_kind][(_sq >> 4) * 8 + (_sq & 7)]
+        SQUARE_BONUS[(_kind | BLACK) << 7 | _sq] = PIECE_SQUARE_TABLES[_kind][(7 - (_sq >> 4)) * 8 + (_sq & 7)]
+
+PIECE_CODES = {'P': PAWN, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING,
+               'p': PAWN | BLACK, 'n': KNIGHT | BLACK, 'b': BISHOP | BLACK,
+               'r': ROOK | BLACK, 'q': QUEEN | BLACK, 'k': KING | BLACK}
+CASTLING_CODES = {'K': WHITE_KING_SIDE, 'Q': WHITE_QUEEN_SIDE, 'k': BLACK_KING_SIDE, 'q': BLACK_QUEEN_SIDE}
+PIECE_CHARS = [' '] * 16
+for _char, _code in PIECE_CODES.items():
+    PIECE_CHARS[_code] = _char
+CASTLING_STRINGS = [''.join(char for char in 'KQkq' if rights & CASTLING_CODES[char]) or '-' for rights in range(16)]
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+def to_square(position):
+    return position.row * 16 + position.col
+
+def to_position(sq):
+    return SQUARE_POSITIONS[sq]
+
+def square_name(sq):
+    return chr(ord('a') + (sq & 7)) + str(8 - (sq >> 4))
+
+def parse_square(name):
+    return (8 - int(name[1])) * 16 + ord(name[0]) - ord('a')
+
+# moves are ints: from square in bits 0-7, to square in bits 8-15, promotion piece kind above
+def encode_move(from_sq, to_sq, promotion = EMPTY):
+    return from_sq | to_sq << 8 | promotion << 16
+
+# 16-bit form for files: from and to as row * 8 + col in bits 0-5 and 6-11, promotion kind above
+def pack_move(move):
+    from_sq = move & 0xff
+    to_sq = move >> 8 & 0xff
+    return (from_sq >> 4) * 8 + (from_sq & 7) | ((to_sq >> 4) * 8 + (to_sq & 7)) << 6 | (move >> 16) << 12
+
+def unpack_move(packed):
+    from_index = packed & 63
+    to_index = packed >> 6 & 63
+    return (from_index >> 3) * 16 + (from_index & 7) | ((to_index >> 3) * 16 + (to_index & 7)) << 8 | (packed >> 12) << 16
+
+def move_to_uci(move):
+    uci = square_name(move & 0xff) + square_name(move >> 8 & 0xff)
+    if move >> 16:
+        uci += ' pnbrqk'[move >> 16]
+    return uci
 
 class Board:
     def __init__(self,fen = None):
-        self.board = [[" " for _ in range(8)] for _ in range(8)]
         if fen is None:
-            self.fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
-        else:
-            self.fen = fen
-        
-        self.game_history_fen = [fen]
-
-        self.white_to_play = True
-        self.white_king_side_castle = True
-        self.white_queen_side_castle = True
-        self.black_king_side_castle = True
-        self.black_queen_side_castle = True
-        self.en_passant = None
-        self.halfmove_number = 0
-        self.fullmove_number = 1
-
-        self.piece_list = []
-        self.position_list = []
-        self._construct_board(self.fen)
-
-        self.state = {'board':self.board.copy(),
-                      'white_to_play':self.white_to_play,
-                      'white_king_side_castle':self.white_king_side_castle,
-                      'white_queen_side_castle':self.white_queen_side_castle,
-                      'black_king_side_castle':self.black_king_side_castle,
-                      'black_queen_side_castle':self.black_queen_side_castle,
-                      'en_passant':self.en_passant,
-                      'halfmove_number':self.halfmove_number,
-                      'fullmove_number':self.fullmove_number,
-                      'position_list': copy.deepcopy(self.position_list)}
-        self.game_history_state = [self.state]
+            fen = START_FEN
+        self.set_fen(fen)
+
+    def set_fen(self,fen):
+        #(re)initialise the board from a FEN string; bulk loaders reuse one Board this way. Raises
+        #ValueError for a malformed FEN and then leaves the board as it was.
+        self._construct_board(fen)
+        self.halfmove_number = 0 #plies played on this board
+        self._key = self._compute_key()
+        self._eval = self._compute_eval()
+
+        #one (move, captured, castling, ep_square, halfmove_clock, key, eval) record per ply played
+        self._undo_stack = []
+        #moves taken back with _restore_history_last, replayed by _restore_history_next
+        self._redo_stack = []
+        self._objects = None
+        self._status = None
+        self._fen = None
 
     def __str__(self):
         ret = []
@@ -44,9 +222,9 @@ class Board:
             ret.append("| " + ' '.join([piece.__str__() for piece in row]) + " |")
 
         for piece in self.piece_list:
-            if piece.is_white and piece.position == Position(-1,-1):
+            if piece.is_white and piece.position is OFF_BOARD:
                 white_killed.append(piece)
-            elif not piece.is_white and piece.position == Position(-1,-1):
+            elif not piece.is_white and piece.position is OFF_BOARD:
                 black_killed.append(piece)
 
         ret[0] = ret[0] + "    " +  " ".join([str(piece) for piece in white_killed])
@@ -57,91 +235,298 @@ class Board:
         str_board = '\n'.join(ret)
         return str_board
 
-    
+    # The Piece/Position object view of the board (board grid, piece_list, position_list) is
+    # built from the square array on first use after a change; the engine itself never reads it.
+    @property
+    def board(self):
+        if self._objects is None:
+            self._build_objects()
+        return self._objects[0]
+
+    @property
+    def piece_list(self):
+        if self._objects is None:
+            self._build_objects()
+        return self._objects[1]
+
+    @property
+    def position_list(self):
+        return [piece.position for piece in self.piece_list]
+
+    def _build_objects(self):
+        grid = [[" " for _ in range(8)] for _ in range(8)]
+        pieces = []
+        for sq in SQUARES:
+            code = self.squares[sq]
+            if code != EMPTY:
+                piece = PIECE_CLASSES[code & 7](not code & BLACK, SQUARE_POSITIONS[sq])
+                grid[sq >> 4][sq & 7] = piece
+                pieces.append(piece)
+        for record in self._undo_stack:
+            if record[1] != EMPTY:
+                pieces.append(PIECE_CLASSES[record[1] & 7](not record[1] & BLACK, OFF_BOARD))
+        self._objects = (grid, pieces)
+
+    #the FEN string is only built when read, and then kept until the position or a clock changes
+    @property
+    def fen(self):
+        tag = (self._key, self.halfmove_clock, self.fullmove_number)
+        if self._fen is None or self._fen[0] != tag:
+            self._fen = (tag, self._build_fen())
+        return self._fen[1]
+
+    @fen.setter
+    def fen(self,fen):
+        self.set_fen(fen)
+
+    @property
+    def game_history_fen(self):
+        #FEN of every position played on this board, oldest first
+        moves = []
+        while self._undo_stack:
+            moves.append(self.unmake_move())
+        fens = [self.fen]
+        for move in reversed(moves):
+            self.make_move(move)
+            fens.append(self.fen)
+        return fens
+
+    @property
+    def zobrist_key(self):
+        return self._key
+
+    def _compute_key(self):
+        #full recompute; make_move keeps self._key up to date incrementally
+        key = 0
+        for sq in SQUARES:
+            if self.squares[sq] != EMPTY:
+                key ^= ZOBRIST_PIECES[self.squares[sq] << 7 | sq]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if self.ep_square >= 0:
+            key ^= ZOBRIST_EN_PASSANT[self.ep_square & 7]
+        if not self.white_to_play:
+            key ^= ZOBRIST_SIDE
+        return key
+
+    @property
+    def white_king_side_castle(self):
+        return bool(self.castling & WHITE_KING_SIDE)
+
+    @property
+    def white_queen_side_castle(self):
+        return bool(self.castling & WHITE_QUEEN_SIDE)
+
+    @property
+    def black_king_side_castle(self):
+        return bool(self.castling & BLACK_KING_SIDE)
+
+    @property
+    def black_queen_side_castle(self):
+        return bool(self.castling & BLACK_QUEEN_SIDE)
+
+    @property
+    def en_passant(self):
+        return None if self.ep_square < 0 else to_position(self.ep_square)
+
+    # Running (white material, black material, white square bonus, black square bonus), updated by
+    # make_move and restored from the undo record by unmake_move, so evaluate() costs O(1).
+    # Set Board.debug (or debug on one board) to check it against a full recompute on every call.
+    debug = False
 
-    def move_piece(self, old_position, new_position): #DONE
+    @property
+    def material(self):
+        return self._eval[0], self._eval[1]
+
+    def evaluate(self):
+        #material and piece-square score from the point of view of the side to move
+        material_white, material_black, bonus_white, bonus_black = self._eval
+        score = material_white - material_black + bonus_white - bonus_black
+        if self.debug and self._eval != self._compute_eval():
+            raise AssertionError("incremental evaluation " + str(self._eval) + " != " + str(self._compute_eval())
+                                 + " in " + self.fen)
+        return score if self.white_to_play else -score
+
+    def _compute_eval(self):
+        #full recompute of the running evaluation sums
+        sums = [0, 0, 0, 0]
+        for sq in SQUARES:
+            code = self.squares[sq]
+            if code != EMPTY:
+                side = 1 if code & BLACK else 0
+                sums[side] += PIECE_VALUES[code & 7]
+                sums[2 + side] += SQUARE_BONUS[code << 7 | sq]
+        return tuple(sums)
+
+    def move_piece(self, old_position, new_position, promotion = QUEEN): #DONE
         kill = False
         killed_piece = None
         killed_piece_position = None
         #checks
-        if self.board[old_position.row][old_position.col] == " ":
-            print("No piece to move.")
+        if promotion not in (QUEEN, ROOK, BISHOP, KNIGHT):
+            raise ValueError("promotion must be QUEEN, ROOK, BISHOP or KNIGHT")
+        if self.squares[to_square(old_position)] == EMPTY:
+            log.logger.warning("No piece to move.")
+            return (False,None,None)
+        if bool(self.squares[to_square(old_position)] & BLACK) == self.white_to_play:
+            #_valid_moves answers for either colour; only the side to move may play
+            log.logger.warning("Not this side's turn.")
             return (False,None,None)
         if not self._is_move_valid(old_position,new_position):
-            print("Invalid move.")
+            log.logger.warning("Invalid move.")
             return (False,None,None)
         
         #move logic
-        if self.board[new_position.row][new_position.col] != " ":
+        from_sq = to_square(old_position)
+        to_sq = to_square(new_position)
+        if self.squares[from_sq] & 7 != PAWN or (to_sq >> 4 != 0 and to_sq >> 4 != 7):
+            promotion = EMPTY
+        ep_square = self.ep_square
+        self.make_move(encode_move(from_sq,to_sq,promotion))
+        self._redo_stack = []
+
+        captured = self.last_capture()
+        if captured != EMPTY:
             kill = True
-            killed_piece = self.board[new_position.row][new_position.col]
-            killed_piece_position = killed_piece.position
-            self.board[new_position.row][new_position.col].position = Position(-1,-1)
-            self.board[old_position.row][old_position.col].position = new_position
-            self.board[new_position.row][new_position.col] = self.board[old_position.row][old_position.col]
-            self.board[old_position.row][old_position.col] = " "
-        else:
-            self.board[old_position.row][old_position.col].position = new_position
-            self.board[new_position.row][new_position.col] = self.board[old_position.row][old_position.col]
-            self.board[old_position.row][old_position.col] = " "
+            killed_piece = PIECE_CLASSES[captured & 7](not captured & BLACK, OFF_BOARD)
+            if to_sq == ep_square and self.squares[to_sq] & 7 == PAWN:
+                killed_piece_position = Position(old_position.row, new_position.col)
+            else:
+                killed_piece_position = new_position
 
-        #board state updates 
-        self.halfmove_number += 1
-        if self.white_to_play:
-            self.white_to_play = False
+        return (kill,killed_piece,killed_piece_position)
+
+    def make_move(self,move):
+        #play an encoded move on the square array, pushing what unmake_move needs to take it back
+        squares = self.squares
+        from_sq = move & 0xff
+        to_sq = move >> 8 & 0xff
+        piece = squares[from_sq]
+        black = piece & BLACK
+        kind = piece & 7
+        ep_square = self.ep_square
+        captured_sq = to_sq
+        if kind == PAWN and to_sq == ep_square:
+            captured_sq = to_sq - 16 if black else to_sq + 16
+        captured = squares[captured_sq]
+        self._undo_stack.append((move, captured, self.castling, ep_square, self.halfmove_clock, self._key, self._eval))
+        key = self._key ^ ZOBRIST_SIDE ^ ZOBRIST_PIECES[piece << 7 | from_sq]
+        bonus = -SQUARE_BONUS[piece << 7 | from_sq]
+        promoted = 0
+        lost = lost_bonus = 0
+        if captured != EMPTY:
+            squares[captured_sq] = EMPTY
+            key ^= ZOBRIST_PIECES[captured << 7 | captured_sq]
+            lost = PIECE_VALUES[captured & 7]
+            lost_bonus = SQUARE_BONUS[captured << 7 | captured_sq]
+        if ep_square >= 0:
+            key ^= ZOBRIST_EN_PASSANT[ep_square & 7]
+        squares[to_sq] = piece
+        squares[from_sq] = EMPTY
+        self.ep_square = -1
+        if kind == PAWN:
+            self.halfmove_clock = 0
+            if move >> 16:
+                piece = move >> 16 | black
+                squares[to_sq] = piece
+                promoted = PIECE_VALUES[move >> 16] - PIECE_VALUES[PAWN]
+            elif (to_sq - from_sq == 32 or from_sq - to_sq == 32) and self._ep_capturable((from_sq + to_sq) >> 1, not black):
+                #only a capturable e.p. square is kept, so a position has one key and one FEN
+                self.ep_square = (from_sq + to_sq) >> 1
+                key ^= ZOBRIST_EN_PASSANT[to_sq & 7]
+        elif captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        key ^= ZOBRIST_PIECES[piece << 7 | to_sq]
+        bonus += SQUARE_BONUS[piece << 7 | to_sq]
+        if kind == KING:
+            self.king_squares[1 if black else 0] = to_sq
+            if to_sq - from_sq == 2:
+                squares[from_sq + 1] = squares[from_sq + 3]
+                squares[from_sq + 3] = EMPTY
+                key ^= ZOBRIST_PIECES[(ROOK | black) << 7 | from_sq + 3] ^ ZOBRIST_PIECES[(ROOK | black) << 7 | from_sq + 1]
+                bonus += SQUARE_BONUS[(ROOK | black) << 7 | from_sq + 1] - SQUARE_BONUS[(ROOK | black) << 7 | from_sq + 3]
+            elif from_sq - to_sq == 2:
+                squares[from_sq - 1] = squares[from_sq - 4]
+                squares[from_sq - 4] = EMPTY
+                key ^= ZOBRIST_PIECES[(ROOK | black) << 7 | from_sq - 4] ^ ZOBRIST_PIECES[(ROOK | black) << 7 | from_sq - 1]
+                bonus += SQUARE_BONUS[(ROOK | black) << 7 | from_sq - 1] - SQUARE_BONUS[(ROOK | black) << 7 | from_sq - 4]
+        castling = self.castling & CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        if castling != self.castling:
+            key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling]
+            self.castling = castling
+        self._key = key
+        material_white, material_black, bonus_white, bonus_black = self._eval
+        if black:
+            self._eval = (material_white - lost, material_black + promoted, bonus_white - lost_bonus, bonus_black + bonus)
         else:
-            self.white_to_play = True
+            self._eval = (material_white + promoted, material_black - lost, bonus_white + bonus, bonus_black - lost_bonus)
+        self.halfmove_number += 1
+        if black:
             self.fullmove_number += 1
-        self._check_castling()
-        self._check_en_passant()
-        
-        #update fen
-        self._update_fen()
-        self._save_state()
-        
-        return (kill,killed_piece,killed_piece_position)
-    
-    def _save_state(self):
-        state_var = {'board':self.board.copy(),
-                      'white_to_play':self.white_to_play,
-                      'white_king_side_castle':self.white_king_side_castle,
-                      'white_queen_side_castle':self.white_queen_side_castle,
-                      'black_king_side_castle':self.black_king_side_castle,
-                      'black_queen_side_castle':self.black_queen_side_castle,
-                      'en_passant':self.en_passant,
-                      'halfmove_number':self.halfmove_number,
-                      'fullmove_number':self.fullmove_number,
-                      'position_list': copy.deepcopy(self.position_list)}
-        assert(len(self.game_history_state) >= self.halfmove_number)
-        self.game_history_state = self.game_history_state[:self.halfmove_number]
-        self.game_history_state.append(state_var)
-
-    def _restore_state(self,state):
-        self.board = state['board']
-        self.white_to_play = state['white_to_play']
-        self.white_king_side_castle = state['white_king_side_castle']
-        self.white_queen_side_castle = state['white_queen_side_castle']
-        self.black_king_side_castle = state['black_king_side_castle']
-        self.black_queen_side_castle = state['black_queen_side_castle'] 
-        self.en_passant = state['en_passant']
-        self.halfmove_number = state['halfmove_number']
-        self.fullmove_number = state['fullmove_number']
-        # self.position_list = state['position_list']
-        for idx,val in enumerate(state['position_list']):
-            self.piece_list[idx].position.row = val.row
-            self.piece_list[idx].position.col = val.col
+        self.white_to_play = bool(black)
+        self._objects = None
+
+    def unmake_move(self):
+        move, captured, self.castling, ep_square, self.halfmove_clock, self._key, self._eval = self._undo_stack.pop()
+        squares = self.squares
+        from_sq = move & 0xff
+        to_sq = move >> 8 & 0xff
+        piece = squares[to_sq]
+        black = piece & BLACK
+        if move >> 16:
+            piece = PAWN | black
+        squares[from_sq] = piece
+        kind = piece & 7
+        if kind == PAWN and to_sq == ep_square:
+            squares[to_sq] = EMPTY
+            squares[to_sq - 16 if black else to_sq + 16] = captured
+        else:
+            squares[to_sq] = captured
+        if kind == KING:
+            self.king_squares[1 if black else 0] = from_sq
+            if to_sq - from_sq == 2:
+                squares[from_sq + 3] = squares[from_sq + 1]
+                squares[from_sq + 1] = EMPTY
+            elif from_sq - to_sq == 2:
+                squares[from_sq - 4] = squares[from_sq - 1]
+                squares[from_sq - 1] = EMPTY
+        self.ep_square = ep_square
+        self.halfmove_number -= 1
+        if black:
+            self.fullmove_number -= 1
+        self.white_to_play = not black
+        self._objects = None
+        return move
+
+    def generate_moves(self):
+        #all legal moves of the side to move, encoded, promotions expanded to every piece
+        black = 0 if self.white_to_play else BLACK
+        squares = self.squares
+        checks, pins = self._pins_and_checks(black)
+        moves = []
+        for sq in SQUARES:
+            if squares[sq] != EMPTY and squares[sq] & BLACK == black:
+                promoting = squares[sq] & 7 == PAWN and sq >> 4 == (6 if black else 1)
+                for target in self._legal_targets(sq,checks,pins):
+                    if promoting:
+                        for kind in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            moves.append(sq | target << 8 | kind << 16)
+                    else:
+                        moves.append(sq | target << 8)
+        return moves
 
     def _restore_history_last(self):
-        if self.halfmove_number > 0:
-            self._restore_state(self.game_history_state[self.halfmove_number-1])
+        if self._undo_stack:
+            self._redo_stack.append(self.unmake_move())
         else:
-            print("No more history.")
+            log.logger.warning("No more history.")
 
     def _restore_history_next(self):
-        if self.halfmove_number < len(self.game_history_state):
-            self._restore_state(self.game_history_state[self.halfmove_number+1])
+        if self._redo_stack:
+            self.make_move(self._redo_stack.pop())
         else:
-            print("No more history.")
+            log.logger.warning("No more history.")
     
     def _is_move_valid(self,old_position,new_position): #DONE
         if old_position == new_position:
@@ -155,169 +540,394 @@ class Board:
             return False
 
     def _valid_moves(self,position): #DONE
-        assert(position != Position(-1,-1))
+        assert(position is not OFF_BOARD)
         #get all moves for a piece at a position, checking for checks
-        if self.board[position.row][position.col] == " ":
+        sq = to_square(position)
+        if self.squares[sq] == EMPTY:
             return []
-        piece = self.board[position.row][position.col]
-        ret = []
-        for move in piece.possible_moves(self.board):
-            if not self._king_checked_after_move(position,move):
-                ret.append(move)
-        return ret
-
-    def _king_checked_after_move(self,old_position,new_position): #DONE
-        assert(old_position != Position(-1,-1) and new_position != Position(-1,-1))
-        #move
-        killed_piece = None
-        if self.board[new_position.row][new_position.col] != " ":
-            killed_piece = self.board[new_position.row][new_position.col]
-            self.board[new_position.row][new_position.col].position = Position(-1,-1)
-            self.board[old_position.row][old_position.col].position = new_position
-            self.board[new_position.row][new_position.col] = self.board[old_position.row][old_position.col]
-            self.board[old_position.row][old_position.col] = " "
-        else:
-            self.board[old_position.row][old_position.col].position = new_position
-            self.board[new_position.row][new_position.col] = self.board[old_position.row][old_position.col]
-            self.board[old_position.row][old_position.col] = " "
+        if bool(self.squares[sq] & BLACK) != self.white_to_play:
+            #side to move: read the position's cached move list, one entry per promotion target
+            return [to_position(move >> 8 & 0xff) for move in self.status().moves
+                    if move & 0xff == sq and (move >> 16 == EMPTY or move >> 16 == QUEEN)]
+        checks, pins = self._pins_and_checks(self.squares[sq] & BLACK)
+        return [to_position(target) for target in self._legal_targets(sq,checks,pins)]
 
-        king_under_check = False
-        #logic
-        king = None
-        for piece in self.piece_list:
-            if self.white_to_play == piece.is_white and piece.__str__().lower() == 'k':
-                king = piece
-                break
-        for piece in self.piece_list:
-            if piece.is_white != self.white_to_play:
-                for move in piece.possible_moves(self.board):
-                    if move == king.position:
-                        king_under_check = True
-                        break
-        
+    def _legal_targets(self,sq,checks,pins):
+        #filter the pseudo-legal moves of the piece on sq against the position's checks and pins
+        moves = self._pseudo_moves(sq)
+        piece = self.squares[sq]
+        if piece & 7 == KING:
+            legal = []
+            for to in moves:
+                if to - sq == 2 or sq - to == 2:
+                    if checks is not None or self._is_attacked((sq + to) >> 1,not piece & BLACK):
+                        continue
+                if not self._exposes_king(sq,to):
+                    legal.append(to)
+            return legal
+        if piece & 7 == PAWN and self.ep_square in moves:
+            #en passant removes a piece off the move's line, so test it directly
+            line = pins.get(sq)
+            legal = []
+            for to in moves:
+                if to == self.ep_square:
+                    if not self._exposes_king(sq,to):
+                        legal.append(to)
+                elif (checks is None or to in checks) and (line is None or to in line):
+                    legal.append(to)
+            return legal
+        if checks is not None:
+            moves = [to for to in moves if to in checks]
+        if sq in pins:
+            line = pins[sq]
+            moves = [to for to in moves if to in line]
+        return moves
 
-        #unmove
-        self.board[new_position.row][new_position.col].position = old_position
-        self.board[old_position.row][old_position.col] = self.board[new_position.row][new_position.col]
-        if killed_piece:
-            killed_piece.position = new_position
-            self.board[new_position.row][new_position.col] = killed_piece
-        else:
-            self.board[new_position.row][new_position.col] = " "
+    def _pins_and_checks(self,black):
+        #checks: None when the king of the given colour is not in check, otherwise the squares a
+        #non-king move has to land on (capture or block). pins: pinned square -> squares it may move to.
+        squares = self.squares
+        king_sq = self.king_squares[1 if black else 0]
+        enemy = 0 if black else BLACK
+        checks = None
+        num_checkers = 0
+        pins = {}
+        for slider, rays in ((BISHOP, BISHOP_RAYS[king_sq]), (ROOK, ROOK_RAYS[king_sq])):
+            for ray in rays:
+                own = -1
+                for i, to in enumerate(ray):
+                    piece = squares[to]
+                    if piece != EMPTY:
+                        if piece & BLACK != enemy:
+                            if own >= 0:
+                                break
+                            own = to
+                        else:
+                            if piece & 7 == slider or piece & 7 == QUEEN:
+                                if own >= 0:
+                                    pins[own] = ray[:i + 1]
+                                else:
+                                    num_checkers += 1
+                                    checks = ray[:i + 1]
+                            break
+        knight = KNIGHT | enemy
+        for frm in KNIGHT_TARGETS[king_sq]:
+            if squares[frm] == knight:
+                num_checkers += 1
+                checks = (frm,)
+        pawn = PAWN | enemy
+        for frm in PAWN_CAPTURES[1 if black else 0][king_sq]:
+            if squares[frm] == pawn:
+                num_checkers += 1
+                checks = (frm,)
+        if num_checkers > 1:
+            checks = ()
+        return checks, pins
 
+    def _exposes_king(self,from_sq,to_sq):
+        #play the move on the square array only, test the mover's king, take it back
+        squares = self.squares
+        moving = squares[from_sq]
+        captured_sq = to_sq
+        if moving & 7 == PAWN and to_sq == self.ep_square:
+            captured_sq = to_sq - 16 if moving & BLACK else to_sq + 16
+        captured = squares[captured_sq]
+        squares[captured_sq] = EMPTY
+        squares[to_sq] = moving
+        squares[from_sq] = EMPTY
+        black = moving & BLACK
+        king_sq = to_sq if moving & 7 == KING else self.king_squares[1 if black else 0]
+        king_under_check = self._is_attacked(king_sq,not black)
+        squares[from_sq] = moving
+        squares[to_sq] = EMPTY
+        squares[captured_sq] = captured
         return king_under_check
-        
+
+    def _pseudo_moves(self,sq): #all target squares for the piece on sq, not checking for checks
+        squares = self.squares
+        piece = squares[sq]
+        kind = piece & 7
+        black = piece & BLACK
+        moves = []
+        if kind == PAWN:
+            row = sq >> 4
+            if row == 0 or row == 7:
+                return moves
+            step = 16 if black else -16
+            if squares[sq + step] == EMPTY:
+                moves.append(sq + step)
+                if row == (1 if black else 6) and squares[sq + 2 * step] == EMPTY:
+                    moves.append(sq + 2 * step)
+            for to in PAWN_CAPTURES[1 if black else 0][sq]:
+                if squares[to] != EMPTY:
+                    if squares[to] & BLACK != black:
+                        moves.append(to)
+                elif to == self.ep_square and to >> 4 == (5 if black else 2):
+                    moves.append(to)
+        elif kind == KNIGHT or kind == KING:
+            for to in (KNIGHT_TARGETS if kind == KNIGHT else KING_TARGETS)[sq]:
+                if squares[to] == EMPTY or squares[to] & BLACK != black:
+                    moves.append(to)
+            if kind == KING and sq == (0x04 if black else 0x74) and self.castling:
+                if (self.castling & (BLACK_KING_SIDE if black else WHITE_KING_SIDE)
+                        and squares[sq + 1] == EMPTY and squares[sq + 2] == EMPTY and squares[sq + 3] == ROOK | black):
+                    moves.append(sq + 2)
+                if (self.castling & (BLACK_QUEEN_SIDE if black else WHITE_QUEEN_SIDE)
+                        and squares[sq - 1] == EMPTY and squares[sq - 2] == EMPTY and squares[sq - 3] == EMPTY
+                        and squares[sq - 4] == ROOK | black):
+                    moves.append(sq - 2)
+        else:
+            for ray in SLIDER_RAYS[kind][sq]:
+                for to in ray:
+                    if squares[to] == EMPTY:
+                        moves.append(to)
+                    else:
+                        if squares[to] & BLACK != black:
+                            moves.append(to)
+                        break
+        return moves
+
+    def _ep_capturable(self,sq,by_black): #could a pawn of the given colour capture en passant on sq
+        pawn = PAWN | (BLACK if by_black else 0)
+        for frm in PAWN_CAPTURES[0 if by_black else 1][sq]:
+            if self.squares[frm] == pawn:
+                return True
+        return False
+
+    def _is_attacked(self,sq,by_black): #is sq attacked by any piece of the given colour
+        squares = self.squares
+        colour = BLACK if by_black else 0
+        pawn = PAWN | colour
+        for frm in PAWN_CAPTURES[0 if by_black else 1][sq]:
+            if squares[frm] == pawn:
+                return True
+        knight = KNIGHT | colour
+        for frm in KNIGHT_TARGETS[sq]:
+            if squares[frm] == knight:
+                return True
+        king = KING | colour
+        for frm in KING_TARGETS[sq]:
+            if squares[frm] == king:
+                return True
+        bishop = BISHOP | colour
+        queen = QUEEN | colour
+        for ray in BISHOP_RAYS[sq]:
+            for frm in ray:
+                if squares[frm] != EMPTY:
+                    if squares[frm] == bishop or squares[frm] == queen:
+                        return True
+                    break
+        rook = ROOK | colour
+        for ray in ROOK_RAYS[sq]:
+            for frm in ray:
+                if squares[frm] != EMPTY:
+                    if squares[frm] == rook or squares[frm] == queen:
+                        return True
+                    break
+        return False
 
     def _construct_board(self,fen):
-        rows = fen.split('/')
-        rows[-1] = rows[-1].split(' ')[0]
+        #parse and check everything first, then set the position fields
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError("FEN needs 1 to 6 fields: " + repr(fen))
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("FEN needs 8 ranks: " + repr(fen))
+        squares = [EMPTY] * 128
+        king_squares = [-1, -1] # white, black
         for row_num, row in enumerate(rows):
             it = 0
             for char in row:
-                if char.isdigit():
-                    for _ in range(int(char)):
-                        self.board[row_num][it] = " "
-                        it += 1
+                if char in '12345678':
+                    it += int(char)
+                    continue
+                code = PIECE_CODES.get(char)
+                if code is None:
+                    raise ValueError("bad piece " + repr(char) + " in FEN " + repr(fen))
+                if it < 8:
+                    squares[row_num * 16 + it] = code
+                    if code & 7 == KING:
+                        if king_squares[1 if code & BLACK else 0] >= 0:
+                            raise ValueError("more than one king of a colour in FEN " + repr(fen))
+                        king_squares[1 if code & BLACK else 0] = row_num * 16 + it
+                it += 1
+            if it != 8:
+                raise ValueError("rank " + repr(row) + " does not have 8 squares in FEN " + repr(fen))
+        if -1 in king_squares:
+            raise ValueError("FEN needs a king of each colour: " + repr(fen))
+        if len(fields) > 1 and fields[1] not in ('w', 'b'):
+            raise ValueError("side to move must be w or b in FEN " + repr(fen))
+        white_to_play = len(fields) < 2 or fields[1] == 'w'
+        castling = 15 #without a castling field every right the placement allows
+        if len(fields) > 2:
+            if fields[2] != '-' and (not set(fields[2]) <= set(CASTLING_CODES) or len(set(fields[2])) != len(fields[2])):
+                raise ValueError("bad castling field in FEN " + repr(fen))
+            castling = 0
+            for char in fields[2].strip('-'):
+                castling |= CASTLING_CODES[char]
+        for sq, piece in CASTLING_HOMES:
+            if squares[sq] != piece:
+                castling &= CASTLING_MASK[sq] #a right whose king or rook has left cannot be used
+        ep_square = -1
+        if len(fields) > 3 and fields[3] != '-':
+            name = fields[3]
+            if len(name) != 2 or name[0] not in 'abcdefgh' or name[1] != ('6' if white_to_play else '3'):
+                raise ValueError("bad en passant square in FEN " + repr(fen))
+            ep_square = parse_square(name)
+        halfmove_clock = 0
+        fullmove_number = 1
+        if len(fields) > 4:
+            if not fields[4].isdigit() or (len(fields) > 5 and not fields[5].isdigit()):
+                raise ValueError("move counters must be numbers in FEN " + repr(fen))
+            halfmove_clock = int(fields[4]) #plies since the last capture or pawn move
+            if len(fields) > 5:
+                fullmove_number = max(1, int(fields[5]))
+
+        self.squares = squares
+        self.king_squares = king_squares
+        self.white_to_play = white_to_play
+        self.castling = castling
+        self.ep_square = ep_square if ep_square >= 0 and self._ep_capturable(ep_square, not white_to_play) else -1
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+    def _build_fen(self):
+        squares = self.squares
+        rows = []
+        for start in range(0, 128, 16):
+            row = ''
+            empty = 0
+            for sq in range(start, start + 8):
+                if squares[sq] == EMPTY:
+                    empty += 1
                 else:
-                    if char.lower() == 'p':
-                        self.board[row_num][it] = Pawn(not char.islower(), Position(row_num, it))
-                    elif char.lower() == 'r':
-                        self.board[row_num][it] = Rook(not char.islower(), Position(row_num, it))
-                    elif char.lower() == 'n':
-                        self.board[row_num][it] = Knight(not char.islower(), Position(row_num, it))
-                    elif char.lower() == 'b':
-                        self.board[row_num][it] = Bishop(not char.islower(), Position(row_num, it))
-                    elif char.lower() == 'q':
-                        self.board[row_num][it] = Queen(not char.islower(), Position(row_num, it))
-                    elif char.lower() == 'k':
-                        self.board[row_num][it] = King(not char.islower(), Position(row_num, it))
-                    self.piece_list.append(self.board[row_num][it])
-                    self.position_list.append(self.board[row_num][it].position)
-                    it += 1
-
-    def _update_fen(self): #IMPLEMENT THIS
-        pass
-
-    def _check_castling(self): #IMPLEMENT THIS
-        pass 
-
-    def _check_en_passant(self): #IMPLEMENT THIS
-        pass
-
-    def _play_random_move(self): #IMPLEMENT THIS
-        legal_piece_moves = []
-        for piece in self.piece_list:
-            # assert(self.board[piece.position.row][piece.position.col] == piece)
-            for move in legal_piece_moves:
-                assert(move[0].row < 8 and move[0].col < 8)
-                # assert(self.board[move[0].row][move[0].col].is_white == self.white_to_play)            
-            if piece.is_white == self.white_to_play and piece.position != Position(-1,-1):
-                print(piece.__str__(),end=' ')
-                all_piece_moves = self._valid_moves(piece.position)
-                for move in all_piece_moves:
-                    assert(piece.is_white == self.white_to_play)
-                    assert(self._board_vs_piece_list_check())
-                    legal_piece_moves.append((piece.position,move))
-                    # assert(self.board[legal_piece_moves[-1][0].row][legal_piece_moves[-1][0].col].is_white == self.white_to_play)
-                    # assert(legal_piece_moves[-1][0].row >= 0 and legal_piece_moves[-1][0].col >= 0)
-                # legal_piece_moves += [(piece.position,move) for move in self._valid_moves(piece.position)]
-        assert(len(legal_piece_moves) > 0)
-        for move in legal_piece_moves:
-            assert(move[0].row < 8 and move[0].col < 8)
-            assert(self.board[move[0].row][move[0].col].is_white == self.white_to_play)
-
-            # assert(move[0].row >= 0 and move[0].col >= 0)
-            # assert(self.board[move[0].row][move[0].col].position != Position(-1,-1))
-            print(self.board[move[0].row][move[0].col].__str__()+": "+move[0].__str__(),'->',move[1].__str__(),end='    ')
-        move = random.choice(legal_piece_moves)
-        print("\n\nDecided : ",self.board[move[0].row][move[0].col].__str__()+": "+move[0].__str__(),'->',move[1].__str__(),"\n\n")
-        self.move_piece(move[0],move[1])
+                    if empty:
+                        row += str(empty)
+                        empty = 0
+                    row += PIECE_CHARS[squares[sq]]
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        return ' '.join(('/'.join(rows), 'w' if self.white_to_play else 'b', CASTLING_STRINGS[self.castling],
+                         square_name(self.ep_square) if self.ep_square >= 0 else '-',
+                         str(self.halfmove_clock), str(self.fullmove_number)))
 
-    def is_mate(self): 
-        legal_moves = []
-        for piece in self.piece_list:
-            if piece.is_white == self.white_to_play and piece.position != Position(-1,-1):
-                legal_moves.extend(self._valid_moves(piece.position))
-        return len(legal_moves) == 0
-        
+    def _play_random_move(self):
+        self.move_piece(*random.choice([(to_position(move & 0xff), to_position(move >> 8 & 0xff))
+                                        for move in self.legal_moves()]))
+
+    def status(self):
+        #legal moves, check flag and game state of the current position. Computed on first use and
+        #kept until the position changes (tagged with the Zobrist key, so make/unmake, move_piece and
+        #history restores all invalidate it without extra bookkeeping).
+        status = self._cached_status()
+        if status.moves is None:
+            status.moves = self.generate_moves()
+        return status
+
+    def _cached_status(self):
+        #the check flag is cheap, the move list is only filled in by status()
+        status = self._status
+        if status is None or status.key != self._key:
+            if self.white_to_play:
+                in_check = self._is_attacked(self.king_squares[0],True)
+            else:
+                in_check = self._is_attacked(self.king_squares[1],False)
+            status = GameStatus(self._key,None,in_check)
+            self._status = status
+        return status
 
+    def legal_moves(self):
+        #cached generate_moves(); treat the list as read-only
+        return self.status().moves
+
+    def is_mate(self): 
+        return not self.status().moves
 
     def is_check(self): 
-        king_under_check = False
-        king = None
-        for piece in self.piece_list:
-            if self.white_to_play == piece.is_white and piece.__str__().lower() == 'k':
-                king = piece
-                break
-        for piece in self.piece_list:
-            if piece.is_white != self.white_to_play:
-                for move in piece.possible_moves(self.board):
-                    if move == king.position:
-                        king_under_check = True
-                        break
-        return king_under_check
+        return self._cached_status().in_check
     
     def is_checkmate(self): 
-        return self.is_mate() and self.is_check()
+        return self.status().state == CHECKMATE
+
+    def last_capture(self):
+        #piece code taken by the last move played, EMPTY if it captured nothing
+        return self._undo_stack[-1][1] if self._undo_stack else EMPTY
+
+    def is_repetition(self):
+        #the position already occurred since the last capture or pawn move, with the same side to move
+        key = self._key
+        stack = self._undo_stack
+        for i in range(2, min(self.halfmove_clock, len(stack)) + 1, 2):
+            if stack[-i][5] == key:
+                return True
+        return False
+
+    def repetition_count(self):
+        #how many times the current position has occurred, this time included (3 is a draw by rule)
+        key = self._key
+        stack = self._undo_stack
+        count = 1
+        for i in range(2, min(self.halfmove_clock, len(stack)) + 1, 2):
+            if stack[-i][5] == key:
+                count += 1
+        return count
     
     def _board_vs_piece_list_check(self):
         for piece in self.piece_list:
-            if piece.position != Position(-1,-1):
+            if piece.position is not OFF_BOARD:
                 if self.board[piece.position.row][piece.position.col] != piece:
                     return False
-        for row in self.board:
-            for piece in row:
-                if piece != " ":
-                    if piece.position == Position(-1,-1):
-                        return False
+                if self.squares[to_square(piece.position)] != piece.code:
+                    return False
+        for sq in SQUARES:
+            if self.squares[sq] != EMPTY and self.board[sq >> 4][sq & 7] == " ":
+                return False
+        if self.squares[self.king_squares[0]] != KING or self.squares[self.king_squares[1]] != KING | BLACK:
+            return False
         return True
         
 
 
+IN_PROGRESS = "In Progress"
+CHECK = "Check"
+CHECKMATE = "Checkmate"
+STALEMATE = "Stalemate"
+
+class GameStatus:
+    def __init__(self, key, moves, in_check):
+        self.key = key
+        self.moves = moves
+        self.in_check = in_check
+
+    @property
+    def state(self):
+        if self.moves:
+            return CHECK if self.in_check else IN_PROGRESS
+        return CHECKMATE if self.in_check else STALEMATE
+
 class Position: #according to the the board list coordinates, row = 0 is back rank of black.
-    def __init__(self, row, col):
-        self.row = row
-        self.col = col
+    #Immutable and interned: every board square and the off-board sentinel (-1, -1) has exactly one
+    #shared instance, so positions hash, compare by identity and can be dict keys or set members.
+    __slots__ = ('row', 'col')
+
+    def __new__(cls, row, col):
+        position = _INTERNED_POSITIONS.get((row, col))
+        if position is None:
+            position = object.__new__(cls)
+            object.__setattr__(position, 'row', row)
+            object.__setattr__(position, 'col', col)
+        return position
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Position is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Position is immutable")
+
+    def __reduce__(self):
+        return (Position, (self.row, self.col))
 
     def __str__(self):
         # return f"{chr(ord('a')+self.col)}{8-self.row}"
@@ -326,14 +936,57 @@ class Position: #according to the the board list coordinates, row = 0 is back ra
         return f"({self.row}, {self.col})"
     
     def __eq__(self, other):
-        return self.row == other.row and self.col == other.col
+        return self is other or (isinstance(other, Position) and self.row == other.row and self.col == other.col)
+
+    def __hash__(self):
+        return hash((self.row, self.col))
+
+_INTERNED_POSITIONS = {}
+for _row in range(-1, 8):
+    for _col in range(-1, 8):
+        if (_row == -1) == (_col == -1):
+            _INTERNED_POSITIONS[(_row, _col)] = Position(_row, _col)
+OFF_BOARD = _INTERNED_POSITIONS[(-1, -1)]
+# Position for every 0x88 square, None off the board
+SQUARE_POSITIONS = [None] * 128
+for _sq in SQUARES:
+    SQUARE_POSITIONS[_sq] = _INTERNED_POSITIONS[(_sq >> 4, _sq & 7)]
 
 class Piece:
+    __slots__ = ('is_white', 'position', 'code')
+    kind = EMPTY
+
     def __init__(self, is_white, position):
         self.is_white = is_white
         self.position = position
+        self.code = self.kind if is_white else self.kind | BLACK
+
+    #shared by the generators below: targets/rays come from the precomputed square tables
+    def _step_moves(self,board,targets):
+        moves = []
+        for to in targets:
+            target = board[to >> 4][to & 7]
+            if target == " " or target.is_white != self.is_white:
+                moves.append(SQUARE_POSITIONS[to])
+        return moves
+
+    def _slide_moves(self,board,rays):
+        moves = []
+        for ray in rays:
+            for to in ray:
+                target = board[to >> 4][to & 7]
+                if target == " ":
+                    moves.append(SQUARE_POSITIONS[to])
+                else:
+                    if target.is_white != self.is_white:
+                        moves.append(SQUARE_POSITIONS[to])
+                    break
+        return moves
 
 class Pawn(Piece):
+    __slots__ = ()
+    kind = PAWN
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
 
@@ -342,38 +995,27 @@ class Pawn(Piece):
     
     def possible_moves(self,board): #all moves that are possible for a pawn not checking for checks
         moves = []
-        if self.position == Position(-1,-1) or self.position.row == 0 or self.position.row == 7:
+        if self.position is OFF_BOARD or self.position.row == 0 or self.position.row == 7:
             return moves
-        if self.is_white:
-            if board[self.position.row - 1][self.position.col] == " ":
-                moves.append(Position(self.position.row - 1, self.position.col))
-            if self.position.row == 6:
-                if board[self.position.row - 2][self.position.col] == " ":
-                    moves.append(Position(self.position.row - 2, self.position.col))
-            if self.position.col > 0:
-                if board[self.position.row - 1][self.position.col - 1] != " " and not board[self.position.row - 1][self.position.col - 1].is_white:
-                    moves.append(Position(self.position.row - 1, self.position.col - 1))
-            if self.position.col < 7:
-                if board[self.position.row - 1][self.position.col + 1] != " " and not board[self.position.row - 1][self.position.col + 1].is_white:
-                    moves.append(Position(self.position.row - 1, self.position.col + 1))
-        else:
-            if board[self.position.row + 1][self.position.col] == " ":
-                moves.append(Position(self.position.row + 1, self.position.col))
-            if self.position.row == 1:
-                if board[self.position.row + 2][self.position.col] == " ":
-                    moves.append(Position(self.position.row + 2, self.position.col))
-            if self.position.col > 0:
-                if board[self.position.row + 1][self.position.col - 1] != " " and board[self.position.row + 1][self.position.col - 1].is_white:
-                    moves.append(Position(self.position.row + 1, self.position.col - 1))
-            if self.position.col < 7:
-                if board[self.position.row + 1][self.position.col + 1] != " " and board[self.position.row + 1][self.position.col + 1].is_white:
-                    moves.append(Position(self.position.row + 1, self.position.col + 1))
+        step = -1 if self.is_white else 1
+        if board[self.position.row + step][self.position.col] == " ":
+            moves.append(Position(self.position.row + step, self.position.col))
+            if self.position.row == (6 if self.is_white else 1):
+                if board[self.position.row + 2 * step][self.position.col] == " ":
+                    moves.append(Position(self.position.row + 2 * step, self.position.col))
+        for to in PAWN_CAPTURES[0 if self.is_white else 1][to_square(self.position)]:
+            target = board[to >> 4][to & 7]
+            if target != " " and target.is_white != self.is_white:
+                moves.append(SQUARE_POSITIONS[to])
         return moves
                     
 
 
 
 class Rook(Piece):
+    __slots__ = ()
+    kind = ROOK
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
         
@@ -381,24 +1023,14 @@ class Rook(Piece):
         return 'R' if self.is_white else 'r'
     
     def possible_moves(self,board):
-        moves = []
-        if self.position == Position(-1,-1):
-            return moves
-        deltas = [(1,0),(-1,0),(0,1),(0,-1)]
-        for delta in deltas:
-            for i in range(1,8):
-                if self.position.row + delta[0] * i < 0 or self.position.row + delta[0] * i > 7 or self.position.col + delta[1] * i < 0 or self.position.col + delta[1] * i > 7:
-                    break
-                if board[self.position.row + delta[0] * i][self.position.col + delta[1] * i] == " ":
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                elif board[self.position.row + delta[0] * i][self.position.col + delta[1] * i].is_white != self.is_white:
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                    break   
-                else:
-                    break
-        return moves
+        if self.position is OFF_BOARD:
+            return []
+        return self._slide_moves(board,ROOK_RAYS[to_square(self.position)])
 
 class Knight(Piece):
+    __slots__ = ()
+    kind = KNIGHT
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
 
@@ -406,20 +1038,14 @@ class Knight(Piece):
         return 'N' if self.is_white else 'n'
     
     def possible_moves(self,board):
-        moves = []
-        if self.position == Position(-1,-1):
-            return moves
-        deltas = [(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2)]
-        for delta in deltas:
-            if self.position.row + delta[0] < 0 or self.position.row + delta[0] > 7 or self.position.col + delta[1] < 0 or self.position.col + delta[1] > 7:
-                continue
-            if board[self.position.row + delta[0]][self.position.col + delta[1]] == " ":
-                moves.append(Position(self.position.row + delta[0], self.position.col + delta[1]))
-            elif board[self.position.row + delta[0]][self.position.col + delta[1]].is_white != self.is_white:
-                moves.append(Position(self.position.row + delta[0], self.position.col + delta[1]))
-        return moves
+        if self.position is OFF_BOARD:
+            return []
+        return self._step_moves(board,KNIGHT_TARGETS[to_square(self.position)])
 
 class Bishop(Piece):
+    __slots__ = ()
+    kind = BISHOP
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
 
@@ -427,24 +1053,14 @@ class Bishop(Piece):
         return 'B' if self.is_white else 'b'
     
     def possible_moves(self,board):
-        moves = []
-        if self.position == Position(-1,-1):
-            return moves
-        deltas = [(1,1),(1,-1),(-1,1),(-1,-1)]
-        for delta in deltas:
-            for i in range(1,8):    
-                if self.position.row + delta[0] * i < 0 or self.position.row + delta[0] * i > 7 or self.position.col + delta[1] * i < 0 or self.position.col + delta[1] * i > 7:
-                    break
-                if board[self.position.row + delta[0] * i][self.position.col + delta[1] * i] == " ":
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                elif board[self.position.row + delta[0] * i][self.position.col + delta[1] * i].is_white != self.is_white:
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                    break
-                else:
-                    break
-        return moves
-    
+        if self.position is OFF_BOARD:
+            return []
+        return self._slide_moves(board,BISHOP_RAYS[to_square(self.position)])
+
 class Queen(Piece):
+    __slots__ = ()
+    kind = QUEEN
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
 
@@ -452,24 +1068,14 @@ class Queen(Piece):
         return 'Q' if self.is_white else 'q'
     
     def possible_moves(self,board):
-        moves = []
-        if self.position == Position(-1,-1):
-            return moves
-        deltas = [(1,1),(1,-1),(-1,1),(-1,-1),(1,0),(-1,0),(0,1),(0,-1)]
-        for delta in deltas:
-            for i in range(1,8):
-                if self.position.row + delta[0] * i < 0 or self.position.row + delta[0] * i > 7 or self.position.col + delta[1] * i < 0 or self.position.col + delta[1] * i > 7:
-                    break
-                if board[self.position.row + delta[0] * i][self.position.col + delta[1] * i] == " ":
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                elif board[self.position.row + delta[0] * i][self.position.col + delta[1] * i].is_white != self.is_white:
-                    moves.append(Position(self.position.row + delta[0] * i, self.position.col + delta[1] * i))
-                    break   
-                else:
-                    break
-        return moves
-    
+        if self.position is OFF_BOARD:
+            return []
+        return self._slide_moves(board,QUEEN_RAYS[to_square(self.position)])
+
 class King(Piece):
+    __slots__ = ()
+    kind = KING
+
     def __init__(self, is_white, position):
         super().__init__(is_white, position)
 
@@ -477,104 +1083,24 @@ class King(Piece):
         return 'K' if self.is_white else 'k'
 
     def possible_moves(self,board):
-        moves = []
-        if self.position == Position(-1,-1):
-            return moves
-        deltas = [(1,1),(1,-1),(-1,1),(-1,-1),(1,0),(-1,0),(0,1),(0,-1)]
-        for delta in deltas:
-            if self.position.row + delta[0] < 0 or self.position.row + delta[0] > 7 or self.position.col + delta[1] < 0 or self.position.col + delta[1] > 7:
-                continue
-            if board[self.position.row + delta[0]][self.position.col + delta[1]] == " ":
-                moves.append(Position(self.position.row + delta[0], self.position.col + delta[1]))
-            elif board[self.position.row + delta[0]][self.position.col + delta[1]].is_white != self.is_white:
-                moves.append(Position(self.position.row + delta[0], self.position.col + delta[1]))
-        return moves
+        if self.position is OFF_BOARD:
+            return []
+        return self._step_moves(board,KING_TARGETS[to_square(self.position)])
+
+PIECE_CLASSES = (None, Pawn, Knight, Bishop, Rook, Queen, King)
+
+log.register(Board)
+log.configure(os.environ.get("PYCHESS_INSTRUMENT"))
 
 def main():
+    #one random game shown at the end; selfplay.py plays many games headless
     board = Board()
     random.seed(1)
-    for row in board.board:
-        for col in row:
-            if col != " ":
-                print(col.__str__(),end=' ')
-            else:
-                print(" ",end=' ')
-        print()
-    for row in board.board:
-        for col in row:
-            if col != " ":
-                print(col.is_white,end=' ')
-            else:
-                print(" ",end=' ')
-        print()
-    for row in board.board:
-        for col in row:
-            if col != " ":
-                print(col.position,end=' ')
-            else:
-                print(" ",end=' ')
-        print()
-    # print(board)
-    # print("halfmove number:",board.halfmove_number, "  is_mate:",board.is_mate(), "  is_check:",board.is_check(), "  is_white_to_play:",board.white_to_play)
-    # print("\n--------------------------------\n")
-    # try:
-    #     with open("output.txt", "w") as f:
-    #         print(board.__str__(),file=f)  # This writes "board" to the file with a newline
-    #         print("halfmove number:",board.halfmove_number, "  is_mate:",board.is_mate(), "  is_check:",board.is_check(), "  is_white_to_play:",board.white_to_play,file=f)
-    #         print("\n--------------------------------\n",file=f)
-    #         f.flush()  # Ensure all data is written to the file
-    # except Exception as e:
-    #     print(f"An error occurred: {e}")  # Print any error that occurs
-
-    while not board.is_mate() and board._board_vs_piece_list_check():
-    # while board._board_vs_piece_list_check():
-    # for _ in range(5):
-        print("one ",board._board_vs_piece_list_check())
-        print_str = "halfmove number: "+str(board.halfmove_number)+ "  is_mate: "+str(board.is_mate())+ "  is_check: "+str(board.is_check()) +"  is_white_to_play: "+str(board.white_to_play)
-        print(print_str+"\n")
-        print(board)
-        print("\n--------------------------------\n")
-        try:
-            with open("output.txt", "a") as f:
-                print(print_str,file=f)
-                print(board.__str__(),file=f)  # This writes "board" to the file with a newline
-                print("\n--------------------------------\n",file=f)
-                f.flush()  # Ensure all data is written to the file
-        except Exception as e:
-            print(f"An error occurred: {e}")  # Print any error that occurs
-        key = "p"
-        # input("Enter a key: ")
-        if key == 'q':
-            break
-        elif key == 'b':
-            board._restore_history_last()
-        elif key == 'n':
-            board._restore_history_next()
-        else:
-            print("two ",board._board_vs_piece_list_check())
-            board._play_random_move()
-            print("three ",board._board_vs_piece_list_check())
-            # print("three1 ",board._board_vs_piece_list_check())
-        # if board.is_mate():
-        #     print("three1 ",board._board_vs_piece_list_check())
-        #     for piece in board.piece_list:
-        #         if piece.is_white == board.white_to_play and piece.position != Position(-1,-1):
-        #             print(piece.__str__(),end=' ')
-        #             print(board._valid_moves(piece.position))
-        #     print("three2 ",board._board_vs_piece_list_check())
-        print("three3 ",board._board_vs_piece_list_check())
-        board.is_mate()
-        print("three4 ",board._board_vs_piece_list_check())
-        assert(board._board_vs_piece_list_check())
-    print("four ",board._board_vs_piece_list_check())
-    print_str = "halfmove number: "+str(board.halfmove_number)+ "  is_mate: "+str(board.is_mate())+ "  is_check: "+str(board.is_check()) +"  is_white_to_play: "+str(board.white_to_play)
-    print(print_str+"\n")
+    while not board.is_mate() and board.halfmove_clock < 100:
+        board._play_random_move()
     print(board)
-    print("\n--------------------------------\n")
-
-
+    print("halfmove number:", board.halfmove_number, "  status:", board.status().state)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,175 @@
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from board import START_FEN, Board, move_to_uci, pack_move, unpack_move
+from pgn import parse_san, read_games, san_tokens
+
+# File layout: a 16-byte header (magic, record count) followed by records sorted by position hash
+# then move. Big-endian, so the file can be searched without decoding more than one key per step.
+MAGIC = b'PYCBOOK1'
+HEADER = struct.Struct('>8sQ')
+RECORD = struct.Struct('>QHH') # Zobrist key, 16-bit move (board.pack_move), weight
+KEY = struct.Struct('>Q')
+MAX_WEIGHT = 0xffff
+
+def game_moves(source):
+    #Yields (moves, result) for every game of a corpus: PGN files ('.pgn') go through the SAN parser,
+    #anything else is read as one game per line of UCI moves, optionally ending with the result.
+    if source.endswith('.pgn'):
+        board = Board()
+        for headers, movetext in read_games(source):
+            if 'FEN' in headers:
+                continue #the book only follows games from the normal start position
+            board.set_fen(START_FEN)
+            moves = []
+            for san in san_tokens(movetext):
+                try:
+                    move = parse_san(board, san)
+                except ValueError:
+                    break
+                board.make_move(move)
+                moves.append(move)
+            yield moves, headers.get('Result', '*')
+        return
+    with open(source) as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            result = tokens.pop() if tokens[-1] in ('1-0', '0-1', '1/2-1/2', '*') else '*'
+            yield tokens, result
+
+def build(sources, path, max_ply = 20, min_games = 1):
+    #Counts every (position, move) of the first max_ply plies of each game and writes the book.
+    #A move scores 2 for every game the side that played it won, 1 for a draw or an unknown result
+    #and 0 for a loss; moves seen in fewer than min_games games are dropped. Returns the number of
+    #records written.
+    counts = {}
+    board = Board()
+    for source in sources:
+        for moves, result in game_moves(source):
+            board.set_fen(START_FEN)
+            for move in moves[:max_ply]:
+                if isinstance(move, str):
+                    move = uci_move(board, move)
+                    if move is None:
+                        break
+                if result == '1/2-1/2' or result == '*':
+                    points = 1
+                else:
+                    points = 2 if (result == '1-0') == board.white_to_play else 0
+                entry = counts.setdefault((board.zobrist_key, pack_move(move)), [0, 0])
+                entry[0] += 1
+                entry[1] += points
+                board.make_move(move)
+    records = sorted((key, move, weight) for (key, move), (games, weight) in counts.items() if games >= min_games)
+    scale = max((weight for _, _, weight in records), default=0) / MAX_WEIGHT
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for key, move, weight in records:
+            if scale > 1:
+                weight = int(weight / scale)
+            f.write(RECORD.pack(key, move, weight))
+    os.replace(path + '.tmp', path)
+    return len(records)
+
+def uci_move(board, text):
+    #a legal move of board from its UCI text, or None
+    for move in board.legal_moves():
+        if move_to_uci(move) == text:
+            return move
+    return None
+
+class Book:
+    #Read-only view of a book file through mmap: nothing is loaded up front, lookups binary search
+    #the mapped pages, and every process opening the same file shares them through the page cache.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a book file")
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def lookup(self, key):
+        #[(move, weight), ...] stored for a Zobrist key, in move order
+        data = self.map
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(data, HEADER.size + middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.size:
+            stored, move, weight = RECORD.unpack_from(data, HEADER.size + low * RECORD.size)
+            if stored != key:
+                break
+            entries.append((unpack_move(move), weight))
+            low += 1
+        return entries
+
+    def moves(self, board):
+        #book moves of the position with their weights, heaviest first
+        return sorted(self.lookup(board.zobrist_key), key=lambda entry: entry[1], reverse=True)
+
+    def choose(self, board, rng = random):
+        #a book move picked at random in proportion to its weight, or None when out of book
+        entries = [entry for entry in self.lookup(board.zobrist_key) if entry[1] > 0]
+        if not entries:
+            return None
+        pick = rng.randrange(sum(weight for _, weight in entries))
+        for move, weight in entries:
+            pick -= weight
+            if pick < 0:
+                return move
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="compile PGN or UCI move-list files into a book")
+    build_parser.add_argument("sources", nargs="+")
+    build_parser.add_argument("--output", default="book.bin")
+    build_parser.add_argument("--max-ply", type=int, default=20)
+    build_parser.add_argument("--min-games", type=int, default=1)
+    probe_parser = commands.add_parser("probe", help="list the book moves of a position")
+    probe_parser.add_argument("book")
+    probe_parser.add_argument("--fen")
+    args = parser.parse_args()
+    if args.command == "build":
+        start = time.perf_counter()
+        records = build(args.sources, args.output, args.max_ply, args.min_games)
+        print(json.dumps({'records': records, 'bytes': os.path.getsize(args.output),
+                          'seconds': round(time.perf_counter() - start, 3)}))
+    else:
+        with Book(args.book) as book:
+            board = Board(args.fen)
+            start = time.perf_counter()
+            moves = book.moves(board)
+            print(json.dumps({'moves': [(move_to_uci(move), weight) for move, weight in moves],
+                              'microseconds': round((time.perf_counter() - start) * 1e6, 1)}))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+from board import Board
+from log import logger
+
+def parse_operations(text):
+    #'bm e4; id "pos 1";' -> {'bm': 'e4', 'id': 'pos 1'}
+    operations = {}
+    for operation in text.split(';'):
+        operation = operation.strip()
+        if not operation:
+            continue
+        opcode, _, operand = operation.partition(' ')
+        operations[opcode] = operand.strip().strip('"')
+    return operations
+
+def split_line(line):
+    #one EPD or FEN record -> (fen, operations), or None for blank and comment lines
+    fields = line.split(None, 4)
+    if len(fields) < 4 or fields[0].startswith('#'):
+        return None
+    placement, side, castling, ep = fields[:4]
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        #full FEN, anything after the move clocks is treated as EPD operations
+        halfmove, fullmove = clocks[0], clocks[1]
+        operations = parse_operations(clocks[2]) if len(clocks) > 2 else {}
+    else:
+        operations = parse_operations(rest)
+        halfmove = operations.get('hmvc', '0')
+        fullmove = operations.get('fmvn', '1')
+    return ' '.join((placement, side, castling, ep, halfmove, fullmove)), operations
+
+def read_epd(source, reuse = False):
+    #Yields (board, operations) for every record of an EPD or FEN file (a path or any iterable of
+    #lines), reading one line at a time. With reuse=True the same Board is reset for every record,
+    #so callers must finish with it before asking for the next one. Records whose FEN does not
+    #parse are logged and skipped.
+    if isinstance(source, str):
+        with open(source) as f:
+            yield from read_epd(f, reuse)
+        return
+    board = None
+    for number, line in enumerate(source, 1):
+        record = split_line(line)
+        if record is None:
+            continue
+        fen, operations = record
+        try:
+            if reuse and board is not None:
+                board.set_fen(fen)
+            else:
+                board = Board(fen)
+        except ValueError as e:
+            logger.warning("line %d: skipping record: %s", number, e)
+            continue
+        yield board, operations
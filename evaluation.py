@@ -0,0 +1,60 @@
+from operator import itemgetter
+
+from board import BLACK, EMPTY, PIECE_SQUARE_TABLES, PIECE_VALUES, SQUARES
+
+try:
+    import numpy as np
+except ImportError: # the scalar path works without numpy, only the batch API needs it
+    np = None
+
+# Material plus square bonus of every piece code on every square, from white's point of view
+# (black pieces score negative): indexed by piece code * 64 + row * 8 + col.
+SQUARE_SCORES = [0] * (16 * 64)
+for _kind in range(1, 7):
+    for _index in range(64):
+        _mirrored = (7 - (_index >> 3)) * 8 + (_index & 7)
+        SQUARE_SCORES[_kind * 64 + _index] = PIECE_VALUES[_kind] + PIECE_SQUARE_TABLES[_kind][_index]
+        SQUARE_SCORES[(_kind | BLACK) * 64 + _index] = -(PIECE_VALUES[_kind] + PIECE_SQUARE_TABLES[_kind][_mirrored])
+
+_board_squares = itemgetter(*SQUARES)
+
+def evaluate(board):
+    #material and piece-square score from the point of view of the side to move
+    score = 0
+    for index, piece in enumerate(_board_squares(board.squares)):
+        if piece != EMPTY:
+            score += SQUARE_SCORES[piece * 64 + index]
+    return score if board.white_to_play else -score
+
+def encode(boards):
+    #N boards -> (pieces, sides): an (N, 64) int8 array of piece codes in row * 8 + col order and an
+    #(N,) int8 array holding 1 where white is to move and -1 where black is. Boards are read one at
+    #a time, so a reused board from epd.read_epd(..., reuse=True) works.
+    _require_numpy()
+    pieces = bytearray()
+    sides = bytearray()
+    for board in boards:
+        pieces += bytes(_board_squares(board.squares))
+        sides.append(1 if board.white_to_play else 255)
+    return (np.frombuffer(bytes(pieces), dtype=np.int8).reshape(-1, 64),
+            np.frombuffer(bytes(sides), dtype=np.int8))
+
+def evaluate_batch(pieces, sides):
+    #scores of every encoded position in one vectorised pass, matching evaluate() exactly
+    _require_numpy()
+    scores = _square_score_array()[pieces.astype(np.intp) * 64 + np.arange(64)].sum(axis=1)
+    return scores * sides.astype(np.int32)
+
+def evaluate_boards(boards):
+    return evaluate_batch(*encode(boards))
+
+_square_score_cache = []
+
+def _square_score_array():
+    if not _square_score_cache:
+        _square_score_cache.append(np.array(SQUARE_SCORES, dtype=np.int32))
+    return _square_score_cache[0]
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("batch evaluation needs numpy")
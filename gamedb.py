@@ -0,0 +1,342 @@
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from board import START_FEN, Board, move_to_uci, pack_move, unpack_move
+from book import uci_move
+from history import GameHistory
+from log import logger
+from pgn import parse_san, read_games, san_tokens
+
+# A database is a directory of append-only files:
+#   games.bin      one record per game: RECORD header, headers as JSON, history.GameHistory bytes
+#   offsets.bin    the offset of every game's record in games.bin (big-endian 64-bit), by game id
+#   results.bin    one result byte per game id
+#   runs/*.idx     the position index as a few sorted runs, each INDEX_HEADER then ENTRY records
+#                  sorted by (key, game, ply): every position of every game with the move played
+#                  from it (0 after the last move). Each batch of appends writes a run and merges it
+#                  with the runs no more than twice its size, so a game is rewritten O(log n) times
+#                  and there are O(log n) runs to search.
+RECORD = struct.Struct('>II') # headers JSON length, game bytes length
+OFFSET = struct.Struct('>Q')
+INDEX_HEADER = struct.Struct('>8sQ')
+INDEX_MAGIC = b'PYCGDB01'
+ENTRY = struct.Struct('>QIHH') # Zobrist key, game id, ply, next move (board.pack_move)
+KEY = struct.Struct('>Q')
+RESULTS = {'1-0': 1, '0-1': 2, '1/2-1/2': 3}
+RESULT_NAMES = ('*', '1-0', '0-1', '1/2-1/2')
+
+def game_records(source):
+    #Yields (headers, fen or None, moves) for every game of a PGN file or of selfplay.py's JSON
+    #lines; games stop at their first move that does not parse and games with a bad FEN are skipped.
+    board = Board()
+    if source.endswith('.pgn'):
+        for number, (headers, movetext) in enumerate(read_games(source)):
+            fen = headers.get('FEN')
+            if not set_up(board, fen, source, number):
+                continue
+            moves = []
+            for san in san_tokens(movetext):
+                try:
+                    move = parse_san(board, san)
+                except ValueError:
+                    break
+                board.make_move(move)
+                moves.append(move)
+            yield headers, fen, moves
+        return
+    with open(source) as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            fen = record.get('fen')
+            if not set_up(board, fen, source, number):
+                continue
+            moves = []
+            for text in record['moves'].split():
+                move = uci_move(board, text)
+                if move is None:
+                    break
+                board.make_move(move)
+                moves.append(move)
+            headers = {'White': record.get('white'), 'Black': record.get('black'), 'Result': record.get('result')}
+            yield headers, None if fen == START_FEN else fen, moves
+
+def set_up(board, fen, source, number):
+    try:
+        board.set_fen(fen or START_FEN)
+    except ValueError as e:
+        logger.warning("%s: skipping game %d: %s", source, number, e)
+        return False
+    return True
+
+class GameDatabase:
+    #Appends go to the end of the game files and into the sorted runs of the position index;
+    #lookups binary search every memory-mapped run, so a query touches a few pages however many
+    #games are stored. One writer at a time.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        for name in ('games.bin', 'offsets.bin', 'results.bin'):
+            open(self.path(name), 'ab').close()
+        os.makedirs(self.path('runs'), exist_ok=True)
+        self.maps = {}
+        self.run_names = None
+        self.state = None
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def close(self):
+        for data in self.maps.values():
+            if data is not None:
+                data.close()
+        self.maps = {}
+        self.run_names = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def map(self, name):
+        #read-only mapping of one of the files (None while it is empty), remapped after appends
+        if name not in self.maps:
+            with open(self.path(*name.split('/')), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self.maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        return self.maps[name]
+
+    def refresh(self):
+        #drop the cached maps and run list when games were appended since they were made, possibly
+        #by another handle: results.bin grows and runs/ changes with every append
+        state = (os.path.getsize(self.path('results.bin')), os.stat(self.path('runs')).st_mtime_ns)
+        if state != self.state:
+            self.close()
+            self.state = state
+
+    def __len__(self):
+        return os.path.getsize(self.path('results.bin'))
+
+    def runs(self):
+        #run file names, oldest (and largest) first; a run is named after its first game id
+        if self.run_names is None:
+            self.run_names = sorted((name for name in os.listdir(self.path('runs')) if name.endswith('.idx')),
+                                    key=lambda name: int(name[:-4]))
+        return list(self.run_names)
+
+    def run_size(self, name):
+        return os.path.getsize(self.path('runs', name))
+
+    # writing
+
+    def append_games(self, games, max_ply = None):
+        #games: iterable of (headers dict, fen or None, [encoded moves]). Returns the new game ids.
+        #max_ply limits how deep each game is indexed (the whole game is stored either way).
+        first = len(self)
+        entries = []
+        ids = []
+        board = Board()
+        with open(self.path('games.bin'), 'ab') as games_file, \
+                open(self.path('offsets.bin'), 'ab') as offsets_file, \
+                open(self.path('results.bin'), 'ab') as results_file:
+            offset = games_file.tell()
+            for game_id, (headers, fen, moves) in enumerate(games, first):
+                history = GameHistory(fen or START_FEN)
+                board.set_fen(fen or START_FEN)
+                for ply, move in enumerate(moves):
+                    if max_ply is None or ply < max_ply:
+                        entries.append((board.zobrist_key, game_id, ply, pack_move(move)))
+                    board.make_move(move)
+                    history.play(move)
+                if max_ply is None or len(moves) < max_ply:
+                    entries.append((board.zobrist_key, game_id, len(moves), 0))
+                header_bytes = json.dumps(headers, separators=(',', ':')).encode()
+                game_bytes = history.to_bytes()
+                record = RECORD.pack(len(header_bytes), len(game_bytes)) + header_bytes + game_bytes
+                games_file.write(record)
+                offsets_file.write(OFFSET.pack(offset))
+                results_file.write(bytes((RESULTS.get(headers.get('Result'), 0),)))
+                offset += len(record)
+                ids.append(game_id)
+        self.close()
+        if ids:
+            entries.sort()
+            self.write_run(str(first) + '.idx', entries, len(entries))
+            runs = self.runs()
+            while len(runs) > 1 and self.run_size(runs[-2]) <= 2 * self.run_size(runs[-1]):
+                self.merge(runs[-2], runs[-1])
+                runs.pop()
+        return ids
+
+    def entries(self, name):
+        data = self.map('runs/' + name)
+        for index in range(INDEX_HEADER.unpack_from(data, 0)[1]):
+            yield ENTRY.unpack_from(data, INDEX_HEADER.size + index * ENTRY.size)
+
+    def write_run(self, name, entries, count):
+        #sorted entries -> a run file, written aside and renamed into place
+        with open(self.path('runs', name + '.tmp'), 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, count))
+            pack = ENTRY.pack
+            buffer = []
+            for entry in entries:
+                buffer.append(pack(*entry))
+                if len(buffer) >= 65536:
+                    f.write(b''.join(buffer))
+                    buffer = []
+            f.write(b''.join(buffer))
+        self.close()
+        os.replace(self.path('runs', name + '.tmp'), self.path('runs', name))
+
+    def merge(self, older, newer):
+        #merges run newer into run older (which keeps its name) and removes newer
+        count = (self.run_size(older) + self.run_size(newer) - 2 * INDEX_HEADER.size) // ENTRY.size
+        self.write_run(older, heapq.merge(self.entries(older), self.entries(newer)), count)
+        os.remove(self.path('runs', newer))
+
+    def compact(self):
+        #merges all runs into one, for the fewest probes per lookup
+        runs = self.runs()
+        while len(runs) > 1:
+            self.merge(runs[-2], runs[-1])
+            runs.pop()
+
+    def add(self, source, max_ply = None, batch = 10000):
+        #stores every game of a PGN file or a selfplay.py results file in batches of appends;
+        #returns how many were added
+        added = 0
+        pending = []
+        for game in game_records(source):
+            pending.append(game)
+            if len(pending) >= batch:
+                added += len(self.append_games(pending, max_ply))
+                pending = []
+        if pending:
+            added += len(self.append_games(pending, max_ply))
+        return added
+
+    # reading
+
+    def lookup(self, key):
+        #[(game id, ply, next move), ...] for every stored occurrence of a Zobrist key, by game id
+        self.refresh()
+        found = []
+        for name in self.runs():
+            data = self.map('runs/' + name)
+            count = INDEX_HEADER.unpack_from(data, 0)[1]
+            low = 0
+            high = count
+            while low < high:
+                middle = (low + high) >> 1
+                if KEY.unpack_from(data, INDEX_HEADER.size + middle * ENTRY.size)[0] < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            while low < count:
+                stored, game_id, ply, move = ENTRY.unpack_from(data, INDEX_HEADER.size + low * ENTRY.size)
+                if stored != key:
+                    break
+                found.append((game_id, ply, unpack_move(move) if move else 0))
+                low += 1
+        return found
+
+    def result(self, game_id):
+        self.refresh()
+        return RESULT_NAMES[self.map('results.bin')[game_id]]
+
+    def record(self, game_id):
+        #(start of the headers JSON, its length, game bytes length) of a stored game; raises
+        #IndexError for an unknown id
+        self.refresh()
+        if not 0 <= game_id < self.state[0]:
+            raise IndexError("no game " + str(game_id))
+        offset = OFFSET.unpack_from(self.map('offsets.bin'), game_id * OFFSET.size)[0]
+        header_length, game_length = RECORD.unpack_from(self.map('games.bin'), offset)
+        return offset + RECORD.size, header_length, game_length
+
+    def headers(self, game_id):
+        #just the headers, without replaying the game
+        start, header_length, _ = self.record(game_id)
+        return json.loads(self.map('games.bin')[start:start + header_length])
+
+    def game(self, game_id):
+        #(headers, GameHistory) of a stored game; raises IndexError for an unknown id
+        start, header_length, game_length = self.record(game_id)
+        data = self.map('games.bin')
+        headers = json.loads(data[start:start + header_length])
+        return headers, GameHistory.from_bytes(data[start + header_length:start + header_length + game_length])
+
+    def stats(self, board):
+        #the games that reached the position and, per move played from it, in how many games and
+        #with what results (a game that came back to the position counts once per move)
+        occurrences = self.lookup(board.zobrist_key)
+        results = self.map('results.bin')
+        totals = [0, 0, 0, 0]
+        moves = {}
+        seen = set()
+        for game_id, _, move in occurrences:
+            result = results[game_id]
+            if game_id not in seen:
+                seen.add(game_id)
+                totals[result] += 1
+            if move and (game_id, move) not in seen:
+                seen.add((game_id, move))
+                counts = moves.setdefault(move, [0, 0, 0, 0])
+                counts[result] += 1
+        return {'games': sum(totals), 'white_wins': totals[1], 'black_wins': totals[2], 'draws': totals[3],
+                'moves': sorted(({'move': move_to_uci(move), 'games': sum(counts), 'white_wins': counts[1],
+                                  'black_wins': counts[2], 'draws': counts[3]} for move, counts in moves.items()),
+                                key=lambda entry: entry['games'], reverse=True)}
+
+    def games_at(self, board, limit = 20):
+        #[(game id, ply, headers)] of the first stored games that reached the position
+        found = []
+        for game_id, ply, _ in self.lookup(board.zobrist_key):
+            if found and found[-1][0] == game_id:
+                continue
+            if len(found) == limit:
+                break
+            found.append((game_id, ply, self.headers(game_id)))
+        return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Position-indexed game database.")
+    parser.add_argument("database", help="database directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="replay and store games")
+    add_parser.add_argument("sources", nargs="+", help="PGN files or selfplay.py results (JSON lines)")
+    add_parser.add_argument("--max-ply", type=int, help="index only the first plies of each game")
+    commands.add_parser("compact", help="merge the position index into one run")
+    query_parser = commands.add_parser("query", help="games and move statistics of a position")
+    query_parser.add_argument("--fen", default=START_FEN)
+    query_parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    with GameDatabase(args.database) as database:
+        start = time.perf_counter()
+        if args.command == "add":
+            added = sum(database.add(source, args.max_ply) for source in args.sources)
+            print(json.dumps({'added': added, 'games': len(database), 'seconds': round(time.perf_counter() - start, 3)}))
+        elif args.command == "compact":
+            database.compact()
+            print(json.dumps({'games': len(database), 'runs': len(database.runs()),
+                              'seconds': round(time.perf_counter() - start, 3)}))
+        else:
+            board = Board(args.fen)
+            stats = database.stats(board)
+            stats['first_games'] = [{'game': game_id, 'ply': ply, 'white': headers.get('White'),
+                                     'black': headers.get('Black'), 'result': headers.get('Result')}
+                                    for game_id, ply, headers in database.games_at(board, args.limit)]
+            stats['milliseconds'] = round((time.perf_counter() - start) * 1000, 3)
+            print(json.dumps(stats, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
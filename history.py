@@ -0,0 +1,114 @@
+import struct
+from array import array
+
+from board import START_FEN, Board, pack_move, unpack_move
+
+MAGIC = b'PYCG'
+VERSION = 1
+HEADER = struct.Struct('>4sBHI') # magic, version, FEN length, ply count; then the FEN and the moves
+
+class GameHistory:
+    #A game as its start FEN plus one 16-bit move (board.pack_move) per ply, with a FEN checkpoint
+    #every checkpoint_every plies, so a long game costs a few bytes per ply. board is the position at
+    #ply; its undo stack only reaches back to the last checkpoint, which keeps back() and forward()
+    #O(1) within a segment and seek() at most checkpoint_every moves of replay anywhere.
+    def __init__(self, fen = None, checkpoint_every = 32):
+        self.start_fen = fen or START_FEN
+        self.checkpoint_every = checkpoint_every
+        self.moves = array('H')
+        self.checkpoints = [self.start_fen]
+        self.board = Board(self.start_fen)
+        self.ply = 0
+        self._base = 0 #ply of the checkpoint self.board was set from
+
+    def __len__(self):
+        return len(self.moves)
+
+    def play(self, move):
+        #play an encoded move at the current ply, dropping any moves after it
+        if self.ply < len(self.moves):
+            del self.moves[self.ply:]
+            del self.checkpoints[self.ply // self.checkpoint_every + 1:]
+        self.board.make_move(move)
+        self.moves.append(pack_move(move))
+        self.ply += 1
+        if self.ply % self.checkpoint_every == 0:
+            self.checkpoints.append(self.board.fen)
+            self._rebase()
+
+    def back(self):
+        if self.ply == 0:
+            return False
+        if self.ply > self._base:
+            self.board.unmake_move()
+            self.ply -= 1
+        else:
+            self.seek(self.ply - 1)
+        return True
+
+    def forward(self):
+        if self.ply == len(self.moves):
+            return False
+        self.board.make_move(unpack_move(self.moves[self.ply]))
+        self.ply += 1
+        if self.ply % self.checkpoint_every == 0:
+            self._rebase()
+        return True
+
+    def seek(self, ply):
+        #go to any ply (clamped to the game) by replaying from the checkpoint at or before it
+        ply = max(0, min(ply, len(self.moves)))
+        self.ply = ply - ply % self.checkpoint_every
+        self._rebase()
+        while self.ply < ply:
+            self.board.make_move(unpack_move(self.moves[self.ply]))
+            self.ply += 1
+
+    def _rebase(self):
+        #restart the board from the checkpoint at self.ply, forgetting the undo records before it
+        self.board.set_fen(self.checkpoints[self.ply // self.checkpoint_every])
+        self._base = self.ply
+
+    def move_list(self):
+        return [unpack_move(packed) for packed in self.moves]
+
+    def memory_bytes(self):
+        #what the stored game itself takes, without the live board
+        return (self.moves.itemsize * len(self.moves)
+                + sum(len(fen) for fen in self.checkpoints) + 8 * len(self.checkpoints))
+
+    def to_bytes(self):
+        fen = self.start_fen.encode()
+        moves = array('H', self.moves)
+        if struct.pack('=H', 1) != struct.pack('>H', 1):
+            moves.byteswap() #moves are stored big-endian like the header
+        return HEADER.pack(MAGIC, VERSION, len(fen), len(moves)) + fen + moves.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, checkpoint_every = 32):
+        #rebuild a game from to_bytes(); the cursor ends at the last ply. Raises ValueError.
+        if len(data) < HEADER.size:
+            raise ValueError("truncated game record")
+        magic, version, fen_length, plies = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a game record")
+        if len(data) != HEADER.size + fen_length + 2 * plies:
+            raise ValueError("truncated game record")
+        fen = data[HEADER.size:HEADER.size + fen_length].decode()
+        moves = array('H')
+        moves.frombytes(data[HEADER.size + fen_length:])
+        if struct.pack('=H', 1) != struct.pack('>H', 1):
+            moves.byteswap()
+        history = cls(fen, checkpoint_every)
+        for packed in moves:
+            history.play(unpack_move(packed))
+        return history
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path, checkpoint_every = 32):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read(), checkpoint_every)
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+# every simulated player starts a session and replays this game, asking for the board and the valid
+# moves of the piece it is about to move before each move, like the frontend does
+OPENING = ('e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6', 'd2d3', 'f8c5', 'e1g1', 'e8g8')
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.session = None
+        self.latencies = {}
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload = None):
+        body = b'' if payload is None else json.dumps(payload).encode()
+        head = [method + ' ' + path + ' HTTP/1.1', 'Host: ' + self.host, 'Content-Length: ' + str(len(body))]
+        if self.session:
+            head.append('X-Session-Id: ' + self.session)
+        if payload is not None:
+            head.append('Content-Type: application/json')
+        start = time.perf_counter()
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        endpoint = path.split('/')[2]
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        return status, json.loads(data) if data else None
+
+    async def play(self, games):
+        await self.connect()
+        status, data = await self.request('POST', '/api/sessions')
+        if status != 200:
+            raise RuntimeError("could not create a session: " + str(data))
+        self.session = data['session']
+        errors = 0
+        for _ in range(games):
+            await self.request('POST', '/api/new-game')
+            for move in OPENING:
+                await self.request('GET', '/api/board')
+                await self.request('GET', '/api/valid-moves/' + move[:2])
+                status, data = await self.request('POST', '/api/move', {'from': move[:2], 'to': move[2:]})
+                if status != 200:
+                    errors += 1
+        self.writer.close()
+        return errors
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summary(latencies):
+    return {'requests': len(latencies), 'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2), 'max_ms': round(max(latencies) * 1000, 2)}
+
+async def run(host, port, clients, games):
+    players = [Client(host, port) for _ in range(clients)]
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(player.play(games) for player in players))
+    seconds = time.perf_counter() - start
+    by_endpoint = {}
+    for player in players:
+        for endpoint, values in player.latencies.items():
+            by_endpoint.setdefault(endpoint, []).extend(values)
+    every = [value for values in by_endpoint.values() for value in values]
+    report = summary(every)
+    report.update({'clients': clients, 'seconds': round(seconds, 3), 'errors': sum(errors),
+                   'requests_per_second': round(len(every) / seconds, 1),
+                   'endpoints': {endpoint: summary(values) for endpoint, values in sorted(by_endpoint.items())}})
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test server.py with concurrent simulated players.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=100, help="concurrent sessions, one connection each")
+    parser.add_argument("--games", type=int, default=2, help="games each client plays")
+    parser.add_argument("--spawn", action="store_true", help="start server.py on --port for the run")
+    parser.add_argument("--workers", type=int, help="worker processes for the spawned server")
+    args = parser.parse_args()
+    server = None
+    if args.spawn:
+        command = [sys.executable, 'server.py', '--host', args.host, '--port', str(args.port),
+                   '--max-sessions', str(max(args.clients * 2, 10000))]
+        if args.workers is not None:
+            command += ['--workers', str(args.workers)]
+        server = subprocess.Popen(command, stdout=subprocess.PIPE)
+        server.stdout.readline() #wait for the "serving on" line
+    try:
+        print(json.dumps(asyncio.run(run(args.host, args.port, args.clients, args.games)), indent=2))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
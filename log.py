@@ -0,0 +1,189 @@
+import logging
+import sys
+import threading
+import time
+
+# Instrumentation for board.Board, switched on and off at runtime. Every switch works by wrapping
+# Board methods when it is turned on and putting the plain functions back when it is turned off,
+# so nothing is paid while a switch is off. PYCHESS_INSTRUMENT=counters,timers,debug,profile turns
+# switches on when board.py is imported.
+
+logger = logging.getLogger('pychess')
+
+# counter name -> Board methods that bump it
+# (_exposes_king tests through _is_attacked, so counting both would count its tests twice)
+COUNTED = {'nodes': ('make_move',), 'movegen': ('generate_moves',), 'check_tests': ('_is_attacked',)}
+TIMED = ('generate_moves', '_pins_and_checks', '_valid_moves', 'move_piece')
+CHECKED = ('make_move', 'unmake_move', 'move_piece')
+
+counters = dict.fromkeys(COUNTED, 0)
+timers = {name: [0, 0.0] for name in TIMED} # name -> [calls, seconds]
+switches = {'counters': False, 'timers': False, 'debug': False, 'profile': False}
+
+_classes = []
+_originals = {}
+_profiler = None
+
+def register(cls):
+    #board.py registers Board here once it is defined
+    if cls not in _classes:
+        _classes.append(cls)
+        _originals[cls] = {name: cls.__dict__[name]
+                           for name in set(TIMED) | set(CHECKED) | {n for names in COUNTED.values() for n in names}}
+        _install(cls)
+        cls.debug = switches['debug']
+
+def configure(spec):
+    #'counters,timers,debug,profile' -> turn those on (and the others off)
+    names = {name.strip() for name in (spec or '').split(',') if name.strip()}
+    for name in switches:
+        enable(name, name in names)
+
+def enable(name, on = True):
+    #name: 'counters', 'timers', 'debug' or 'profile'
+    if name not in switches:
+        raise ValueError("unknown switch " + name)
+    switches[name] = on
+    if name == 'profile':
+        if on and (_profiler is None or not _profiler.running):
+            start_profiler()
+        elif not on:
+            stop_profiler()
+        return
+    for cls in _classes:
+        _install(cls)
+        if name == 'debug':
+            cls.debug = on #Board.evaluate() cross-checks its running sums in debug mode
+
+def disable(name):
+    enable(name, False)
+
+def reset():
+    for name in counters:
+        counters[name] = 0
+    for timer in timers.values():
+        timer[0] = 0
+        timer[1] = 0.0
+
+def report():
+    result = {'switches': dict(switches), 'counters': dict(counters),
+              'timers': {name: {'calls': calls, 'seconds': round(seconds, 6)} for name, (calls, seconds) in timers.items()}}
+    if _profiler is not None:
+        result['profile'] = _profiler.top()
+    return result
+
+def _install(cls):
+    #put back the plain methods, then wrap them for whatever is switched on
+    originals = _originals[cls]
+    methods = dict(originals)
+    if switches['debug']:
+        for name in CHECKED:
+            methods[name] = _checked(methods[name], name)
+    if switches['counters']:
+        for counter, names in COUNTED.items():
+            for name in names:
+                methods[name] = _counted(methods[name], counter)
+    if switches['timers']:
+        for name in TIMED:
+            methods[name] = _timed(methods[name], name)
+    for name, method in methods.items():
+        setattr(cls, name, method)
+
+def _counted(function, counter):
+    def wrapper(*args, **kwargs):
+        counters[counter] += 1
+        return function(*args, **kwargs)
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+def _timed(function, name):
+    timer = timers[name]
+    clock = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += clock() - start
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+def _checked(function, name):
+    #debug mode: the incremental state must match a full recompute after every change
+    def wrapper(board, *args, **kwargs):
+        result = function(board, *args, **kwargs)
+        problems = []
+        if board.zobrist_key != board._compute_key():
+            problems.append("zobrist key")
+        if board._eval != board._compute_eval():
+            problems.append("evaluation sums")
+        if name == 'move_piece' and not board._board_vs_piece_list_check():
+            problems.append("piece list")
+        if problems:
+            raise AssertionError(name + " left " + ", ".join(problems) + " inconsistent in " + board.fen)
+        return result
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+class SamplingProfiler:
+    #Every interval seconds a background thread looks at the profiled thread's current stack and
+    #counts the innermost function (self) and every function on the stack (total). Costs nothing
+    #to the profiled thread beyond the interpreter handing over the GIL to the sampler.
+    def __init__(self, interval = 0.002, thread_id = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.own = {}
+        self.total = {}
+        self.samples = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def sample(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            name = _frame_name(frame)
+            self.own[name] = self.own.get(name, 0) + 1
+            seen = set()
+            while frame is not None:
+                name = _frame_name(frame)
+                if name not in seen:
+                    seen.add(name)
+                    self.total[name] = self.total.get(name, 0) + 1
+                frame = frame.f_back
+
+    def top(self, count = 15):
+        #[(function, self samples, total samples)], most self time first
+        names = sorted(self.own, key=self.own.get, reverse=True)[:count]
+        return [(name, self.own[name], self.total[name]) for name in names]
+
+def _frame_name(frame):
+    code = frame.f_code
+    return code.co_filename.rsplit('/', 1)[-1] + ':' + code.co_name
+
+def start_profiler(interval = 0.002):
+    global _profiler
+    _profiler = SamplingProfiler(interval)
+    _profiler.start()
+    switches['profile'] = True
+    return _profiler
+
+def stop_profiler():
+    #stops sampling and returns the profile; report() keeps showing it until the next start
+    if _profiler is not None and _profiler.running:
+        _profiler.stop()
+    switches['profile'] = False
+    return _profiler.top() if _profiler is not None else []
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import EMPTY, KING, Board, move_to_uci
+from epd import split_line
+from pgn import move_to_san
+
+class BudgetExceeded(Exception):
+    pass
+
+class MateSolver:
+    #Depth-limited AND/OR search for forced mates: at OR nodes the attacker tries only checking
+    #moves, at AND nodes every defence must lose. Mates that need a quiet attacking move are not
+    #found. Results are cached by Zobrist key as "mate in n with this move" and "no checking mate
+    #in n", so transpositions and the iterative deepening of solve() reuse earlier work. The cache
+    #may be shared between solves of related positions.
+    def __init__(self, max_nodes = None, cache = None):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        #key -> (n, move) proven mate in n (move 0 at defender nodes), key -> n no checking mate in n
+        self.proven, self.refuted = cache if cache is not None else ({}, {})
+
+    def solve(self, board, max_moves):
+        #(n, line) for the shortest mate in n <= max_moves found for the side to move, (None, [])
+        #when no mate made of checks exists (a mate starting with a quiet move may still), or
+        #(None, None) when the node budget ran out first. line is the attacker's and the longest
+        #resisting defender's moves. The board is left as it was.
+        root = board.halfmove_number
+        try:
+            for n in range(1, max_moves + 1):
+                if self.attack(board, n):
+                    return n, self.line(board, n)
+        except BudgetExceeded:
+            while board.halfmove_number > root:
+                board.unmake_move()
+            return None, None
+        return None, []
+
+    def count(self):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise BudgetExceeded()
+
+    def attack(self, board, n):
+        #a move that mates in at most n moves, or 0
+        key = board.zobrist_key
+        known = self.proven.get(key)
+        if known is not None and known[0] <= n:
+            return known[1]
+        if self.refuted.get(key, 0) >= n:
+            return 0
+        squares = board.squares
+        checks = []
+        for move in board.legal_moves():
+            self.count()
+            board.make_move(move)
+            if board.is_check():
+                replies = board.legal_moves()
+                if not replies:
+                    board.unmake_move()
+                    self.proven[key] = (1, move)
+                    return move
+                if n > 1:
+                    #try the checks that leave the fewest replies first, captures breaking ties
+                    checks.append((len(replies), squares[move >> 8 & 0xff] == EMPTY, move))
+            board.unmake_move()
+        checks.sort()
+        for _, _, move in checks:
+            board.make_move(move)
+            mated = self.defend(board, n - 1)
+            board.unmake_move()
+            if mated:
+                self.proven[key] = (n, move)
+                return move
+        self.refuted[key] = n
+        return 0
+
+    def defend(self, board, n):
+        #does every reply of the side in check lose to a mate in at most n moves
+        key = board.zobrist_key
+        known = self.proven.get(key)
+        if known is not None and known[0] <= n:
+            return True
+        if self.refuted.get(key, 0) >= n:
+            return False
+        squares = board.squares
+        #king moves and captures of the checker are the likeliest refutations
+        replies = sorted(board.legal_moves(), key=lambda move: (squares[move & 0xff] & 7 != KING,
+                                                               squares[move >> 8 & 0xff] == EMPTY))
+        for move in replies:
+            self.count()
+            board.make_move(move)
+            mate = self.attack(board, n)
+            board.unmake_move()
+            if not mate:
+                self.refuted[key] = n
+                return False
+        self.proven[key] = (n, 0)
+        return True
+
+    def distance(self, board, n):
+        #shortest mate in at most n for the side to move, from the cache where possible
+        for k in range(1, n + 1):
+            if self.attack(board, k):
+                return k
+        return None
+
+    def line(self, board, n):
+        #the mating line of a proven mate in n: the defender always picks the longest resistance
+        line = []
+        while True:
+            n = self.distance(board, n)
+            move = self.attack(board, n)
+            board.make_move(move)
+            line.append(move)
+            replies = board.legal_moves()
+            if not replies:
+                break
+            longest = None
+            for reply in replies:
+                board.make_move(reply)
+                length = self.distance(board, n - 1)
+                board.unmake_move()
+                if longest is None or length > longest[0]:
+                    longest = (length, reply)
+            board.make_move(longest[1])
+            line.append(longest[1])
+            n = longest[0]
+        for _ in line:
+            board.unmake_move()
+        return line
+
+def san_line(board, line):
+    sans = []
+    for move in line:
+        sans.append(move_to_san(board, move))
+        board.make_move(move)
+    for _ in line:
+        board.unmake_move()
+    return sans
+
+def solve_puzzle(job):
+    #worker entry point: (number, EPD line, default moves, node budget) -> result record. The
+    #puzzle's 'dm' operation gives its mate length; 'bm' (SAN) is checked against the first move.
+    #A line that does not parse gets a record with an 'error' instead.
+    number, line, default_moves, max_nodes = job
+    fen, operations = split_line(line)
+    try:
+        board = Board(fen)
+        moves = int(operations.get('dm', default_moves))
+    except ValueError as e:
+        return {'puzzle': number, 'id': operations.get('id'), 'fen': fen, 'error': str(e), 'solved': False,
+                'no_checking_mate': False, 'budget_exceeded': False, 'nodes': 0}
+    solver = MateSolver(max_nodes)
+    start = time.perf_counter()
+    found, mate_line = solver.solve(board, moves)
+    seconds = time.perf_counter() - start
+    record = {'puzzle': number, 'id': operations.get('id'), 'fen': fen, 'moves': moves, 'mate_in': found,
+              'solved': found is not None, 'no_checking_mate': mate_line == [], 'budget_exceeded': mate_line is None,
+              'line': san_line(board, mate_line) if mate_line else [],
+              'nodes': solver.nodes, 'seconds': round(seconds, 4)}
+    if 'bm' in operations and mate_line:
+        record['bm_match'] = record['line'][0].rstrip('+#') in [bm.rstrip('+#') for bm in operations['bm'].split()]
+    return record
+
+def run(source, default_moves = 3, processes = 1, max_nodes = None, output = None):
+    #Solves every puzzle of an EPD file across processes; returns the summary and writes one JSON
+    #line per puzzle to output if given.
+    with open(source) as f:
+        jobs = [(number, line, default_moves, max_nodes)
+                for number, line in enumerate(line for line in f if split_line(line) is not None)]
+    start = time.perf_counter()
+    if processes <= 1:
+        results = list(map(solve_puzzle, jobs))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(solve_puzzle, jobs, chunksize=max(1, len(jobs) // (processes * 8))))
+    seconds = time.perf_counter() - start
+    if output:
+        with open(output, 'w') as out:
+            for record in results:
+                out.write(json.dumps(record) + '\n')
+    solved = sum(record['solved'] for record in results)
+    nodes = sum(record['nodes'] for record in results)
+    matched = [record['bm_match'] for record in results if 'bm_match' in record]
+    return {'puzzles': len(results), 'errors': sum('error' in record for record in results), 'solved': solved,
+            'solve_rate': round(solved / len(results), 4) if results else 0,
+            'no_checking_mate': sum(record['no_checking_mate'] for record in results),
+            'budget_exceeded': sum(record['budget_exceeded'] for record in results),
+            'bm_matches': sum(matched), 'bm_checked': len(matched),
+            'nodes': nodes, 'seconds': round(seconds, 3),
+            'nodes_per_second': int(nodes / seconds) if seconds > 0 else 0}
+
+def main():
+    parser = argparse.ArgumentParser(description="Prove or refute mate in N.")
+    parser.add_argument("epd", nargs="?", help="EPD file of puzzles (dm/bm/id operations are used)")
+    parser.add_argument("--fen", help="solve a single position instead")
+    parser.add_argument("--moves", type=int, default=3, help="mate length when a puzzle has no dm")
+    parser.add_argument("--max-nodes", type=int, help="node budget per puzzle")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="write one JSON line per puzzle here")
+    args = parser.parse_args()
+    if args.fen:
+        board = Board(args.fen)
+        solver = MateSolver(args.max_nodes)
+        start = time.perf_counter()
+        found, line = solver.solve(board, args.moves)
+        print(json.dumps({'mate_in': found, 'no_checking_mate': line == [], 'budget_exceeded': line is None,
+                          'line': san_line(board, line) if line else [], 'uci': [move_to_uci(move) for move in line or []],
+                          'nodes': solver.nodes, 'seconds': round(time.perf_counter() - start, 4)}))
+    elif args.epd:
+        print(json.dumps(run(args.epd, args.moves, args.processes, args.max_nodes, args.output), indent=2))
+    else:
+        parser.error("give an EPD file or --fen")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
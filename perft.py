@@ -0,0 +1,106 @@
+import argparse
+import json
+import sys
+import time
+from multiprocessing import Pool
+
+from board import Board, move_to_uci
+
+# Reference positions with their known leaf counts for depth 1, 2, 3, ...
+SUITE = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position4_mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+def perft(board, depth):
+    if depth == 0:
+        return 1
+    moves = board.generate_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+def divide(board, depth):
+    #leaf count below every root move
+    counts = {}
+    for move in board.generate_moves():
+        board.make_move(move)
+        counts[move_to_uci(move)] = perft(board, depth - 1)
+        board.unmake_move()
+    return counts
+
+def run_position(job):
+    name, fen, depth, expected = job
+    board = Board(fen)
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    seconds = time.perf_counter() - start
+    return {"name": name, "fen": fen, "depth": depth, "nodes": nodes, "expected": expected,
+            "ok": expected is None or nodes == expected, "seconds": round(seconds, 4),
+            "nps": int(nodes / seconds) if seconds > 0 else 0}
+
+def run_suite(depth = 3, processes = 1, suite = SUITE):
+    jobs = []
+    for name, fen, counts in suite:
+        d = min(depth, len(counts))
+        jobs.append((name, fen, d, counts[d - 1]))
+    start = time.perf_counter()
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.map(run_position, jobs)
+    else:
+        results = [run_position(job) for job in jobs]
+    seconds = time.perf_counter() - start
+    nodes = sum(result["nodes"] for result in results)
+    return {"depth": depth, "processes": processes, "positions": results,
+            "nodes": nodes, "seconds": round(seconds, 4),
+            "nps": int(nodes / seconds) if seconds > 0 else 0,
+            "ok": all(result["ok"] for result in results)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Count move generation leaf nodes (perft).")
+    parser.add_argument("--fen", help="run a single position instead of the reference suite")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the leaf count under every root move")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.fen and args.divide:
+        board = Board(args.fen)
+        counts = divide(board, args.depth)
+        for uci in sorted(counts):
+            print(uci + ": " + str(counts[uci]))
+        print("\nnodes: " + str(sum(counts.values())))
+        return 0
+
+    if args.fen:
+        report = run_position(("fen", args.fen, args.depth, None))
+    else:
+        report = run_suite(args.depth, args.processes)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0 if report["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
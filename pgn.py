@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from board import (BISHOP, KING, KNIGHT, PAWN, QUEEN, ROOK, START_FEN, Board,
+                   parse_square, square_name, to_position)
+
+SAN_PIECES = {'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+HEADER_RE = re.compile(r'\[(\w+)\s+"(.*)"\]')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+def read_games(source):
+    #Yields (headers, movetext) for every game of a PGN file (a path or any iterable of lines),
+    #holding one game in memory at a time.
+    if isinstance(source, str):
+        with open(source, errors='replace') as f:
+            yield from read_games(f)
+        return
+    headers = {}
+    movetext = []
+    for line in source:
+        line = line.strip()
+        if line.startswith('['):
+            if movetext:
+                yield headers, '\n'.join(movetext)
+                headers = {}
+                movetext = []
+            match = HEADER_RE.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith('%'):
+            movetext.append(line)
+    if headers or movetext:
+        yield headers, '\n'.join(movetext)
+
+def san_tokens(movetext):
+    #SAN moves of the main line, without comments, variations, NAGs, move numbers and the result
+    depth = 0
+    comment = False
+    for token in re.split(r'(\{|\}|\(|\)|;[^\n]*|\s+)', movetext):
+        if not token or token.isspace():
+            continue
+        if comment:
+            if token == '}':
+                comment = False
+            continue
+        if token == '{':
+            comment = True
+        elif token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and not token.startswith(';') and not token.startswith('$') and token not in RESULTS:
+            token = token.split('.')[-1]
+            if token:
+                yield token
+
+def parse_san(board, san):
+    #resolve a SAN move against the legal moves of the board; raises ValueError
+    text = san.rstrip('+#!?')
+    moves = board.legal_moves()
+    squares = board.squares
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        offset = 2 if len(text) == 3 else -2
+        for move in moves:
+            if squares[move & 0xff] & 7 == KING and (move >> 8 & 0xff) - (move & 0xff) == offset:
+                return move
+        raise ValueError("illegal castling " + san)
+    match = SAN_RE.match(text)
+    if match is None:
+        raise ValueError("unreadable move " + san)
+    piece, from_file, from_rank, target, promotion = match.groups()
+    kind = SAN_PIECES[piece] if piece else PAWN
+    to_sq = parse_square(target)
+    promotion = SAN_PIECES[promotion] if promotion else 0
+    candidates = []
+    for move in moves:
+        from_sq = move & 0xff
+        if (move >> 8 & 0xff != to_sq or squares[from_sq] & 7 != kind or move >> 16 != promotion
+                or (from_file and from_sq & 7 != ord(from_file) - ord('a'))
+                or (from_rank and 8 - (from_sq >> 4) != int(from_rank))):
+            continue
+        candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError(("ambiguous move " if candidates else "illegal move ") + san)
+    return candidates[0]
+
+def move_to_san(board, move):
+    #SAN of a legal move of the board, with + or # appended
+    squares = board.squares
+    from_sq = move & 0xff
+    to_sq = move >> 8 & 0xff
+    kind = squares[from_sq] & 7
+    if kind == KING and to_sq - from_sq in (2, -2):
+        san = 'O-O' if to_sq > from_sq else 'O-O-O'
+    else:
+        capture = squares[to_sq] != 0 or (kind == PAWN and to_sq == board.ep_square)
+        if kind == PAWN:
+            san = square_name(from_sq)[0] + 'x' if capture else ''
+        else:
+            san = 'NBRQK'[kind - 2]
+            others = [other & 0xff for other in board.legal_moves()
+                      if other >> 8 & 0xff == to_sq and other & 0xff != from_sq and squares[other & 0xff] & 7 == kind]
+            if others:
+                if all(other & 7 != from_sq & 7 for other in others):
+                    san += square_name(from_sq)[0]
+                elif all(other >> 4 != from_sq >> 4 for other in others):
+                    san += square_name(from_sq)[1]
+                else:
+                    san += square_name(from_sq)
+            if capture:
+                san += 'x'
+        san += square_name(to_sq)
+        if move >> 16:
+            san += '=' + 'NBRQ'[(move >> 16) - 2]
+    board.make_move(move)
+    if board.is_check():
+        san += '#' if board.is_mate() else '+'
+    board.unmake_move()
+    return san
+
+def replay_game(headers, movetext, board = None):
+    #play a game's main line with move_piece; returns (board, plies, error message or None), with
+    #board None when the game's FEN header cannot be set up
+    fen = headers.get('FEN', START_FEN)
+    try:
+        if board is None:
+            board = Board(fen)
+        else:
+            board.set_fen(fen)
+    except ValueError as e:
+        return None, 0, str(e)
+    plies = 0
+    for san in san_tokens(movetext):
+        try:
+            move = parse_san(board, san)
+        except ValueError as e:
+            return board, plies, "ply " + str(plies + 1) + ": " + str(e)
+        board.move_piece(to_position(move & 0xff), to_position(move >> 8 & 0xff), move >> 16 or QUEEN)
+        plies += 1
+    return board, plies, None
+
+def replay_chunk(chunk):
+    #worker entry point: (first game number, [(headers, movetext), ...]) -> result records
+    first, games = chunk
+    board = Board()
+    results = []
+    for number, (headers, movetext) in enumerate(games, first):
+        replayed, plies, error = replay_game(headers, movetext, board)
+        results.append({'game': number, 'white': headers.get('White'), 'black': headers.get('Black'),
+                        'result': headers.get('Result'), 'plies': plies,
+                        'fen': replayed.fen if replayed is not None else None, 'error': error})
+        board = replayed or Board()
+    return results
+
+def chunks(games, size, skip = 0):
+    chunk = []
+    first = skip
+    for number, game in enumerate(games):
+        if number < skip:
+            continue
+        chunk.append(game)
+        if len(chunk) == size:
+            yield first, chunk
+            first += size
+            chunk = []
+    if chunk:
+        yield first, chunk
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'games': 0, 'offset': 0, 'errors': 0}
+
+def save_checkpoint(path, checkpoint):
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path + '.tmp', path)
+
+def run(source, output, processes = 1, chunk_size = 64, max_pending = None, checkpoint_path = None):
+    #Replays every game of source and appends one JSON line per game to output. At most
+    #max_pending chunks are in flight, so memory stays flat however large the archive is. After
+    #every chunk written the checkpoint records how far the output is complete; running again with
+    #the same checkpoint skips those games and truncates anything written after it.
+    if max_pending is None:
+        max_pending = 2 * processes
+    checkpoint = load_checkpoint(checkpoint_path)
+    start = time.perf_counter()
+    games = 0
+    mode = 'r+' if checkpoint['offset'] and os.path.exists(output) else 'w'
+    with open(output, mode) as out:
+        out.seek(checkpoint['offset'])
+        out.truncate()
+
+        def write(results):
+            nonlocal games
+            for result in results:
+                out.write(json.dumps(result) + '\n')
+                if result['error']:
+                    checkpoint['errors'] += 1
+            out.flush()
+            games += len(results)
+            checkpoint['games'] += len(results)
+            checkpoint['offset'] = out.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+
+        work = chunks(read_games(source), chunk_size, checkpoint['games'])
+        if processes <= 1:
+            for chunk in work:
+                write(replay_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                pending = deque()
+                for chunk in work:
+                    pending.append(pool.submit(replay_chunk, chunk))
+                    if len(pending) >= max_pending:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    seconds = time.perf_counter() - start
+    return {'games': games, 'total_games': checkpoint['games'], 'errors': checkpoint['errors'],
+            'seconds': round(seconds, 3), 'games_per_second': round(games / seconds, 1) if seconds > 0 else 0}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay PGN games through Board.")
+    parser.add_argument("pgn")
+    parser.add_argument("--output", default="pgn_results.jsonl")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--checkpoint", help="resume from and record progress in this file")
+    args = parser.parse_args()
+    print(json.dumps(run(args.pgn, args.output, args.processes, args.chunk_size,
+                         checkpoint_path=args.checkpoint)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import EMPTY, PAWN, Board
+from tt import EXACT, LOWER, UPPER, TranspositionTable
+
+INFINITY = 1000000
+MATE = 100000
+MAX_PLY = 64
+TABLEBASE_MATERIAL = 900 # a queen, the most material any tablebase.py table holds
+
+class Limits:
+    #any combination of a depth, a time budget in seconds and a node budget; None means unlimited
+    def __init__(self, depth = None, movetime = None, nodes = None):
+        if depth is not None and depth < 1:
+            raise ValueError("search depth must be at least 1")
+        self.depth = depth
+        self.movetime = movetime
+        self.nodes = nodes
+
+class SearchStopped(Exception):
+    pass
+
+class Searcher:
+    def __init__(self, board, limits, tt = None, root_moves = None, tablebase = None):
+        self.board = board
+        self.limits = limits
+        self.tt = tt
+        self.tablebase = tablebase
+        #search only these moves at the root (a parallel search worker's share)
+        self.root_moves = root_moves
+        #(depth, best_move, score, pv) of every completed iteration
+        self.iterations = []
+        self.nodes = 0
+        self.start = 0.0
+        self.deadline = None
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+        self.previous_pv = []
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.root_best = None
+
+    def run(self):
+        board = self.board
+        limits = self.limits
+        self.start = time.perf_counter()
+        if limits.movetime is not None:
+            self.deadline = self.start + limits.movetime
+        root_ply = board.halfmove_number
+        if self.tt is not None:
+            self.tt.new_search()
+
+        moves = self.root_moves or board.legal_moves()
+        if not moves:
+            return None, (-MATE if board.is_check() else 0), [], self.stats(0)
+        if self.tablebase is not None and not self.root_moves:
+            known = self.tablebase.best_move(board)
+            if known is not None:
+                move, wdl, plies = known
+                return move, tablebase_score(wdl, plies, 0), [move], self.stats(0)
+        best_move = moves[0]
+        score = 0
+        pv = [best_move]
+        completed = 0
+        max_depth = MAX_PLY if limits.depth is None else min(limits.depth, MAX_PLY)
+        for depth in range(1, max_depth + 1):
+            self.root_best = None
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            except SearchStopped:
+                while board.halfmove_number > root_ply:
+                    board.unmake_move()
+                #a root move that beat the previous best before the deadline is still an improvement
+                if self.root_best is not None:
+                    best_move, score, pv = self.root_best
+                break
+            pv = self.pv[0][:]
+            best_move = pv[0]
+            self.previous_pv = pv
+            completed = depth
+            self.iterations.append((depth, best_move, score, pv))
+            if abs(score) >= MATE - MAX_PLY:
+                break
+            if self.deadline is not None and time.perf_counter() - self.start > limits.movetime / 2:
+                break
+        return best_move, score, pv, self.stats(completed)
+
+    def stats(self, depth):
+        seconds = time.perf_counter() - self.start
+        return {'depth': depth, 'nodes': self.nodes, 'seconds': seconds,
+                'nps': int(self.nodes / seconds) if seconds > 0 else 0}
+
+    def count_node(self):
+        self.nodes += 1
+        if self.limits.nodes is not None and self.nodes >= self.limits.nodes:
+            raise SearchStopped()
+        if self.deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() >= self.deadline:
+            raise SearchStopped()
+
+    def negamax(self, depth, alpha, beta, ply):
+        board = self.board
+        self.pv[ply] = []
+        if ply > 0 and (board.halfmove_clock >= 100 or board.is_repetition()):
+            return 0
+        if ply >= MAX_PLY:
+            return board.evaluate()
+        if self.tablebase is not None and sum(board.material) <= TABLEBASE_MATERIAL:
+            known = self.tablebase.probe(board)
+            if known is not None:
+                return tablebase_score(known[0], known[1], ply)
+        in_check = board.is_check()
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self.quiesce(alpha, beta, ply)
+        self.count_node()
+
+        tt = self.tt
+        tt_move = 0
+        if tt is not None:
+            entry = tt.probe(board.zobrist_key)
+            if entry is not None:
+                tt_depth, tt_score, bound, tt_move = entry
+                if ply > 0 and tt_depth >= depth:
+                    tt_score = score_from_tt(tt_score, ply)
+                    if bound == EXACT or (bound == LOWER and tt_score >= beta) or (bound == UPPER and tt_score <= alpha):
+                        return tt_score
+
+        moves = self.root_moves if ply == 0 and self.root_moves else board.legal_moves()
+        if not moves:
+            return -MATE + ply if in_check else 0
+        moves = self.order(moves, ply, tt_move)
+        squares = board.squares
+        alpha_start = alpha
+        best = -INFINITY
+        best_move = 0
+        for move in moves:
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if ply == 0:
+                        self.root_best = (move, score, self.pv[0][:])
+                    if score >= beta:
+                        if squares[move >> 8 & 0xff] == EMPTY and not move >> 16:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move] = self.history.get(move, 0) + depth * depth
+                        break
+        if tt is not None:
+            if best >= beta:
+                bound = LOWER
+            elif best > alpha_start:
+                bound = EXACT
+            else:
+                bound = UPPER
+            tt.store(board.zobrist_key, depth, score_to_tt(best, ply), bound, best_move)
+        return best
+
+    def quiesce(self, alpha, beta, ply):
+        board = self.board
+        self.count_node()
+        if ply >= MAX_PLY:
+            return board.evaluate()
+        squares = board.squares
+        if board.is_check():
+            #no standing pat in check: every evasion is tried, and none left is mate
+            captures = board.legal_moves()
+            if not captures:
+                return -MATE + ply
+        else:
+            stand_pat = board.evaluate()
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            ep_square = board.ep_square
+            captures = [move for move in board.legal_moves()
+                        if squares[move >> 8 & 0xff] != EMPTY or move >> 16
+                        or (move >> 8 & 0xff == ep_square and squares[move & 0xff] & 7 == PAWN)]
+        captures.sort(key=lambda move: (squares[move >> 8 & 0xff] & 7) * 8 - (squares[move & 0xff] & 7), reverse=True)
+        for move in captures:
+            board.make_move(move)
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def order(self, moves, ply, tt_move = 0):
+        #hash move and previous principal variation first, then captures by MVV-LVA and promotions,
+        #killers, history
+        squares = self.board.squares
+        pv_move = self.previous_pv[ply] if ply < len(self.previous_pv) else 0
+        killers = self.killers[ply]
+        history = self.history
+
+        def score(move):
+            if move == tt_move:
+                return 1 << 31
+            if move == pv_move:
+                return 1 << 30
+            victim = squares[move >> 8 & 0xff]
+            if victim != EMPTY or move >> 16:
+                return (1 << 29) + ((victim & 7) + (move >> 16)) * 8 - (squares[move & 0xff] & 7)
+            if move == killers[0] or move == killers[1]:
+                return 1 << 28
+            return history.get(move, 0)
+        return sorted(moves, key=score, reverse=True)
+
+def tablebase_score(wdl, plies, ply):
+    #a tablebase result as a mate score seen from the root
+    if wdl > 0:
+        return MATE - ply - plies
+    if wdl < 0:
+        return -MATE + ply + plies
+    return 0
+
+def score_to_tt(score, ply):
+    #mate scores are stored relative to the node, not the root
+    if score >= MATE - MAX_PLY:
+        return score + ply
+    if score <= -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= MATE - MAX_PLY:
+        return score - ply
+    if score <= -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+def search(board, limits = None, tt = None, tablebase = None):
+    #returns (best_move, score, pv, stats); best_move is None when there is no legal move.
+    #The board is searched in place and is back in its original position on return.
+    #Pass a tt.TranspositionTable to reuse work across transpositions and across calls, and a
+    #tablebase.Tablebase to score covered endgames exactly instead of searching them.
+    if limits is None:
+        limits = Limits(depth=4)
+    return Searcher(board, limits, tt, tablebase=tablebase).run()
+
+def search_root_moves(job):
+    #parallel_search worker: (fen, root moves, depth, movetime, nodes, tt_mb) -> (iterations, nodes)
+    fen, moves, depth, movetime, nodes, tt_mb = job
+    tt = TranspositionTable(tt_mb) if tt_mb else None
+    searcher = Searcher(Board(fen), Limits(depth, movetime, nodes), tt, moves)
+    searcher.run()
+    return searcher.iterations, searcher.nodes
+
+def parallel_search(board, limits = None, workers = None, pool = None, tt_mb = 16):
+    #Root splitting: the legal root moves are dealt round-robin (best ordered first) to the workers,
+    #each of which runs the normal iterative deepening over its share on a board rebuilt from the
+    #FEN, with its own transposition table of tt_mb megabytes. The results are merged at the deepest
+    #iteration every worker completed, so the scores compared were all searched to the same depth.
+    #Pass a ProcessPoolExecutor as pool to reuse worker processes across calls. Same return value
+    #as search(); the node limit applies per worker. Repetitions before the root are not seen.
+    if limits is None:
+        limits = Limits(depth=4)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    moves = board.legal_moves()
+    workers = min(workers, len(moves))
+    if workers <= 1:
+        return search(board, limits)
+    start = time.perf_counter()
+    ordered = Searcher(board, limits).order(moves, 0)
+    jobs = [(board.fen, ordered[i::workers], limits.depth, limits.movetime, limits.nodes, tt_mb)
+            for i in range(workers)]
+    if pool is None:
+        with ProcessPoolExecutor(workers) as own_pool:
+            results = list(own_pool.map(search_root_moves, jobs))
+    else:
+        results = list(pool.map(search_root_moves, jobs))
+
+    nodes = sum(result[1] for result in results)
+    #a worker stopped before finishing depth 1 has nothing comparable and is left out; one that
+    #proved a mate stops early, and its score holds at any depth, so it does not count towards the
+    #common depth either
+    completed = [iterations for iterations, _ in results if iterations]
+    unproven = [len(iterations) for iterations in completed if abs(iterations[-1][2]) < MATE - MAX_PLY]
+    depth = min(unproven) if unproven else max((len(iterations) for iterations in completed), default=0)
+    best = (ordered[0], -INFINITY, [ordered[0]]) if completed else (ordered[0], 0, [ordered[0]])
+    for iterations in completed:
+        candidate = iterations[min(depth, len(iterations)) - 1][1:]
+        if candidate[1] > best[1]:
+            best = candidate
+    seconds = time.perf_counter() - start
+    stats = {'depth': depth, 'nodes': nodes, 'seconds': seconds, 'workers': workers,
+             'nps': int(nodes / seconds) if seconds > 0 else 0}
+    return best[0], best[1], best[2], stats
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import combinations
+
+from board import START_FEN, Board, move_to_uci
+from epd import read_epd
+from search import Limits, search
+from tt import TranspositionTable
+
+class RandomPlayer:
+    def __init__(self, rng):
+        self.rng = rng
+
+    def choose(self, board):
+        return self.rng.choice(board.legal_moves())
+
+class EnginePlayer:
+    #search() with fixed limits and, with tt=MB, a transposition table kept for the whole game
+    def __init__(self, limits, tt_mb = 0):
+        self.limits = limits
+        self.tt = TranspositionTable(tt_mb) if tt_mb else None
+
+    def choose(self, board):
+        return search(board, self.limits, self.tt)[0]
+
+def make_player(spec, rng):
+    #'random' or 'engine:depth=3,movetime=0.1,nodes=20000,tt=16' (any subset of the options)
+    name, _, options = spec.partition(':')
+    if name == 'random':
+        return RandomPlayer(rng)
+    if name != 'engine':
+        raise ValueError("unknown player " + spec)
+    values = dict(option.split('=') for option in options.split(',') if option)
+    limits = Limits(int(values['depth']) if 'depth' in values else None,
+                    float(values['movetime']) if 'movetime' in values else None,
+                    int(values['nodes']) if 'nodes' in values else None)
+    if limits.depth is None and limits.movetime is None and limits.nodes is None:
+        limits.depth = 2
+    return EnginePlayer(limits, int(values.get('tt', 0)))
+
+def play_game(job):
+    #worker entry point: one game -> a compact result record
+    number, fen, white, black, seed, max_plies = job
+    rng = random.Random(seed)
+    board = Board(fen)
+    players = (make_player(white, rng), make_player(black, rng))
+    thinking = [0.0, 0.0]
+    moves = []
+    start = time.perf_counter()
+    while True:
+        if not board.legal_moves():
+            if board.is_check():
+                result, reason = ('0-1' if board.white_to_play else '1-0'), 'checkmate'
+            else:
+                result, reason = '1/2-1/2', 'stalemate'
+            break
+        if board.halfmove_clock >= 100:
+            result, reason = '1/2-1/2', 'fifty moves'
+            break
+        if board.repetition_count() >= 3:
+            result, reason = '1/2-1/2', 'repetition'
+            break
+        if sum(board.material) == 0:
+            result, reason = '1/2-1/2', 'bare kings'
+            break
+        if len(moves) >= max_plies:
+            result, reason = '1/2-1/2', 'ply limit'
+            break
+        side = 0 if board.white_to_play else 1
+        clock = time.perf_counter()
+        move = players[side].choose(board)
+        thinking[side] += time.perf_counter() - clock
+        board.make_move(move)
+        moves.append(move_to_uci(move))
+    return {'game': number, 'white': white, 'black': black, 'fen': fen, 'result': result, 'reason': reason,
+            'plies': len(moves), 'moves': ' '.join(moves), 'seconds': round(time.perf_counter() - start, 4),
+            'white_seconds': round(thinking[0], 4), 'black_seconds': round(thinking[1], 4)}
+
+def schedule(players, games, openings, seed, max_plies):
+    #every pair of players meets games times, alternating colours; both games of a colour swap
+    #start from the same opening
+    number = 0
+    for first, second in combinations(players, 2):
+        for round_number in range(games):
+            fen = openings[(round_number // 2) % len(openings)]
+            white, black = (first, second) if round_number % 2 == 0 else (second, first)
+            yield number, fen, white, black, seed + number, max_plies
+            number += 1
+
+def run(players, games, output, processes = 1, openings = None, seed = 1, max_plies = 400):
+    #Plays the tournament and writes one JSON line per game to output (a path, or None), through
+    #one buffered file handle. Returns the summary with speed and per-player results.
+    openings = openings or [START_FEN]
+    jobs = schedule(players, games, openings, seed, max_plies)
+    table = {player: {'games': 0, 'wins': 0, 'draws': 0, 'losses': 0} for player in players}
+    reasons = {}
+    total_plies = 0
+    total_games = 0
+    start = time.perf_counter()
+    with (open(output, 'w', buffering=1 << 16) if output else nullcontext()) as out, \
+            (ProcessPoolExecutor(processes) if processes > 1 else nullcontext()) as pool:
+        results = pool.map(play_game, jobs, chunksize=4) if pool is not None else map(play_game, jobs)
+        for record in results:
+            if out is not None:
+                out.write(json.dumps(record, separators=(',', ':')) + '\n')
+            total_games += 1
+            total_plies += record['plies']
+            reasons[record['reason']] = reasons.get(record['reason'], 0) + 1
+            white = table[record['white']]
+            black = table[record['black']]
+            white['games'] += 1
+            black['games'] += 1
+            if record['result'] == '1-0':
+                white['wins'] += 1
+                black['losses'] += 1
+            elif record['result'] == '0-1':
+                black['wins'] += 1
+                white['losses'] += 1
+            else:
+                white['draws'] += 1
+                black['draws'] += 1
+    seconds = time.perf_counter() - start
+    for stats in table.values():
+        stats['score'] = round((stats['wins'] + stats['draws'] / 2) / stats['games'], 3) if stats['games'] else 0
+    return {'games': total_games, 'plies': total_plies, 'seconds': round(seconds, 3),
+            'games_per_second': round(total_games / seconds, 2) if seconds > 0 else 0,
+            'plies_per_second': round(total_plies / seconds, 1) if seconds > 0 else 0,
+            'reasons': reasons, 'players': table}
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless self-play tournament.")
+    parser.add_argument("players", nargs="*", default=["random", "engine:depth=1"],
+                        help="'random' or 'engine:depth=N,movetime=S,nodes=N,tt=MB'; every pair plays")
+    parser.add_argument("--games", type=int, default=10, help="games per pair of players")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="selfplay.jsonl", help="results file, '-' for none")
+    parser.add_argument("--openings", help="EPD/FEN file of start positions")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-plies", type=int, default=400)
+    args = parser.parse_args()
+    if len(set(args.players)) < 2:
+        parser.error("need at least two different players")
+    openings = [board.fen for board, _ in read_epd(args.openings)] if args.openings else None
+    summary = run(list(dict.fromkeys(args.players)), args.games, None if args.output == '-' else args.output,
+                  args.processes, openings, args.seed, args.max_plies)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import secrets
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from board import (BISHOP, KNIGHT, PIECE_CHARS, QUEEN, ROOK, START_FEN, Board, move_to_uci,
+                   pack_move, parse_square, square_name, unpack_move)
+from book import Book
+from gamedb import GameDatabase
+from log import logger
+from search import Limits, search
+
+PROMOTIONS = {'q': QUEEN, 'r': ROOK, 'b': BISHOP, 'n': KNIGHT}
+DEFAULT_SESSION = 'default'
+MAX_BODY = 4096
+MIN_MOVETIME = 0.01
+MAX_MOVETIME = 5.0
+MAX_GAMES = 100
+MAX_PLIES = 2048 #per session, so a session's move list stays bounded
+
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+# Everything below down to Session runs in the worker processes: it gets a FEN, does the move
+# generation or search there and sends back plain data, so the event loop never does engine work.
+
+book = None #opened once per worker process by open_files; the pages are shared between them
+database = None
+
+def open_files(book_path, database_path):
+    global book, database
+    if book_path:
+        book = Book(book_path)
+    if database_path:
+        database = GameDatabase(database_path)
+
+def describe(board):
+    status = board.status()
+    return {'fen': board.fen, 'turn': 'white' if board.white_to_play else 'black', 'status': status.state}
+
+def play(fen, from_name, to_name, promotion = 'q'):
+    #validate and play one move; returns the new position or an 'error' entry
+    board = Board(fen)
+    from_sq = square(from_name)
+    to_sq = square(to_name)
+    if from_sq < 0 or to_sq < 0:
+        return {'error': "bad square"}
+    kind = PROMOTIONS.get(promotion, QUEEN)
+    for move in board.legal_moves():
+        if move & 0xff == from_sq and move >> 8 & 0xff == to_sq and move >> 16 in (0, kind):
+            return played(board, move)
+    return {'error': "illegal move " + str(from_name) + str(to_name)}
+
+def engine_move(fen, movetime):
+    board = Board(fen)
+    if not board.legal_moves():
+        return {'error': "game over"}
+    move = book.choose(board) if book is not None else None
+    if move is None or move not in board.legal_moves():
+        move = search(board, Limits(movetime=movetime))[0]
+    return played(board, move)
+
+def position_games(fen, limit):
+    #the stored games through a position with per-move statistics, for the frontend's FEN display
+    if database is None:
+        return {'error': "no game database"}
+    try:
+        board = Board(fen)
+    except ValueError:
+        return {'error': "bad FEN"}
+    result = database.stats(board)
+    result['fen'] = board.fen
+    result['first_games'] = [{'game': game_id, 'ply': ply, 'white': headers.get('White'), 'black': headers.get('Black'),
+                              'result': headers.get('Result')} for game_id, ply, headers in database.games_at(board, limit)]
+    return result
+
+def square(name):
+    #'e4' -> 0x88 square, -1 for anything that is not a square name
+    if not isinstance(name, str) or len(name) != 2 or name[0] not in 'abcdefgh' or name[1] not in '12345678':
+        return -1
+    return parse_square(name)
+
+def played(board, move):
+    board.make_move(move)
+    captured = board.last_capture()
+    result = describe(board)
+    result['move'] = move_to_uci(move)
+    result['packed'] = pack_move(move)
+    result['captured'] = PIECE_CHARS[captured] if captured else None
+    return result
+
+def valid_moves(fen, name):
+    board = Board(fen)
+    sq = square(name)
+    if sq < 0:
+        return {'error': "bad square"}
+    return {'moves': sorted({square_name(move >> 8 & 0xff) for move in board.legal_moves() if move & 0xff == sq})}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Session:
+    # A session keeps only the FEN and the moves as 16-bit board.pack_move values, not a Board, so
+    # thousands of them stay small; a game stops taking moves at MAX_PLIES.
+    __slots__ = ('id', 'fen', 'turn', 'status', 'moves', 'captured', 'lock', 'last_used')
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.lock = asyncio.Lock()
+        self.reset()
+
+    def reset(self):
+        self.fen = START_FEN
+        self.turn = 'white'
+        self.status = 'In Progress'
+        self.moves = array('H')
+        self.captured = {'white': [], 'black': []}
+        self.last_used = time.monotonic()
+
+    def state(self):
+        return {'session': self.id, 'fen': self.fen, 'turn': self.turn, 'status': self.status,
+                'moveCount': len(self.moves), 'moves': [move_to_uci(unpack_move(move)) for move in self.moves],
+                'captured': self.captured}
+
+    def apply(self, result):
+        self.fen = result['fen']
+        self.turn = result['turn']
+        self.status = result['status']
+        self.moves.append(result['packed'])
+        if result['captured']:
+            self.captured['white' if result['captured'].isupper() else 'black'].append(result['captured'])
+
+class GameServer:
+    #Sessions are found by the X-Session-Id header, a session= query parameter or cookie; requests
+    #without one share the 'default' session, which is what the bundled frontend uses. At most
+    #max_sessions are kept (least recently used idle ones are dropped first) and sessions unused for
+    #idle_timeout seconds are evicted. max_sessions bounds the number of sessions; together with
+    #MAX_PLIES per session that bounds their memory.
+    def __init__(self, workers = None, max_sessions = 10000, idle_timeout = 600.0, book_path = None, database_path = None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.book_path = book_path
+        self.database_path = database_path
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+        self.pool = None
+        self.stats = {'requests': 0, 'errors': 0, 'sessions_created': 0, 'sessions_evicted': 0}
+
+    async def start(self, host, port):
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=open_files,
+                                            initargs=(self.book_path, self.database_path))
+            #start the workers now rather than on the first request
+            await asyncio.gather(*(self.run(warm_up) for _ in range(self.workers)))
+        else:
+            open_files(self.book_path, self.database_path)
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        self.evictor = asyncio.ensure_future(self.evict_loop())
+        return self.server
+
+    async def close(self):
+        self.evictor.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def run(self, func, *args):
+        #engine work goes to the process pool; with workers=0 it runs inline (handy for debugging)
+        if self.pool is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    # sessions
+
+    def new_session(self, session_id = None):
+        if len(self.sessions) >= self.max_sessions:
+            self.evict(1)
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPError(503, "too many sessions")
+        session = Session(session_id or secrets.token_hex(16))
+        self.sessions[session.id] = session
+        self.stats['sessions_created'] += 1
+        return session
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            if session_id != DEFAULT_SESSION:
+                raise HTTPError(404, "unknown session")
+            session = self.new_session(DEFAULT_SESSION)
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def evict(self, count = 0, idle_before = None):
+        #drop up to count least recently used sessions, or all idle since idle_before; never busy ones
+        evicted = 0
+        for session in list(self.sessions.values()):
+            if idle_before is not None and session.last_used >= idle_before:
+                break
+            if count and evicted >= count:
+                break
+            if not session.lock.locked():
+                del self.sessions[session.id]
+                evicted += 1
+        self.stats['sessions_evicted'] += evicted
+        return evicted
+
+    async def evict_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 0.1))
+            self.evict(idle_before=time.monotonic() - self.idle_timeout)
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader, self.idle_timeout)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                self.stats['requests'] += 1
+                try:
+                    status, payload, cookie = await self.dispatch(method, path, query, headers, body)
+                except HTTPError as e:
+                    self.stats['errors'] += 1
+                    status, payload, cookie = e.status, {'success': False, 'error': str(e)}, None
+                except Exception:
+                    #a failing or broken worker must not leave the client without an answer
+                    logger.exception("error handling %s %s", method, path)
+                    self.stats['errors'] += 1
+                    status, payload, cookie = 500, {'success': False, 'error': "internal error"}, None
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(response(status, payload, keep_alive, cookie))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except HTTPError as e:
+            writer.write(response(e.status, {'success': False, 'error': str(e)}, False))
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, query, headers, body):
+        if method == 'OPTIONS':
+            return 204, None, None
+        session_id = headers.get('x-session-id') or query.get('session', [None])[0] or cookie_session(headers)
+        if path == '/api/sessions':
+            expect(method, 'POST')
+            session = self.new_session()
+            return 200, dict(session.state(), success=True), session.id
+        if path == '/api/stats':
+            expect(method, 'GET')
+            return 200, dict(self.stats, sessions=len(self.sessions), workers=self.workers), None
+        session = self.session(session_id or DEFAULT_SESSION)
+        if path == '/api/board':
+            expect(method, 'GET')
+            return 200, session.state(), None
+        if path == '/api/new-game':
+            expect(method, 'POST')
+            async with session.lock:
+                session.reset()
+            return 200, dict(session.state(), success=True), None
+        if path.startswith('/api/valid-moves/'):
+            expect(method, 'GET')
+            result = await self.run(valid_moves, session.fen, path[len('/api/valid-moves/'):])
+            if 'error' in result:
+                raise HTTPError(400, result['error'])
+            return 200, result, None
+        if path == '/api/position-games':
+            expect(method, 'GET')
+            try:
+                limit = max(0, min(int(query.get('limit', ['20'])[0]), MAX_GAMES))
+            except ValueError:
+                raise HTTPError(400, "bad limit")
+            result = await self.run(position_games, query.get('fen', [session.fen])[0], limit)
+            if 'error' in result:
+                raise HTTPError(404 if result['error'] == "no game database" else 400, result['error'])
+            return 200, result, None
+        if path == '/api/move':
+            expect(method, 'POST')
+            data = parse_body(body)
+            if square(data.get('from')) < 0 or square(data.get('to')) < 0:
+                raise HTTPError(400, "bad square")
+            async with session.lock:
+                result = await self.run(play, session.fen, data.get('from'), data.get('to'),
+                                        str(data.get('promotion', 'q')).lower())
+                return self.played(session, result)
+        if path == '/api/engine-move':
+            expect(method, 'POST')
+            data = parse_body(body) if body else {}
+            try:
+                movetime = float(data.get('movetime', 0.5))
+            except (TypeError, ValueError):
+                raise HTTPError(400, "bad movetime")
+            if not math.isfinite(movetime):
+                raise HTTPError(400, "bad movetime") #nan would never reach the search deadline
+            movetime = max(MIN_MOVETIME, min(movetime, MAX_MOVETIME))
+            async with session.lock:
+                return self.played(session, await self.run(engine_move, session.fen, movetime))
+        raise HTTPError(404, "no such endpoint")
+
+    def played(self, session, result):
+        if 'error' in result:
+            raise HTTPError(409, result['error'])
+        if len(session.moves) >= MAX_PLIES:
+            raise HTTPError(409, "game reached the " + str(MAX_PLIES) + "-ply limit, start a new game")
+        session.apply(result)
+        return 200, dict(session.state(), success=True, move=result['move'], capture=result['captured']), None
+
+def warm_up():
+    return describe(Board())
+
+def expect(method, allowed):
+    if method != allowed:
+        raise HTTPError(405, "use " + allowed)
+
+def parse_body(body):
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise HTTPError(400, "body is not JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "body must be a JSON object")
+    return data
+
+def cookie_session(headers):
+    for part in headers.get('cookie', '').split(';'):
+        name, _, value = part.strip().partition('=')
+        if name == 'session':
+            return value
+    return None
+
+async def read_request(reader, timeout):
+    #one HTTP/1.1 request -> (method, path, query, headers, body), or None when the client is done
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "bad request line")
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise HTTPError(400, "bad Content-Length")
+    if length < 0:
+        raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "body too large")
+    body = await asyncio.wait_for(reader.readexactly(length), timeout) if length else b''
+    url = urlsplit(target)
+    return method.upper(), url.path.rstrip('/') or '/', parse_qs(url.query), headers, body
+
+def response(status, payload, keep_alive = True, cookie = None):
+    body = b'' if payload is None else json.dumps(payload).encode()
+    head = ['HTTP/1.1 ' + str(status) + ' ' + REASONS.get(status, ''),
+            'Content-Type: application/json',
+            'Content-Length: ' + str(len(body)),
+            'Access-Control-Allow-Origin: *',
+            'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers: Content-Type, X-Session-Id',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    if cookie:
+        head.append('Set-Cookie: session=' + cookie + '; Path=/; HttpOnly; SameSite=Lax')
+    return ('\r\n'.join(head) + '\r\n\r\n').encode() + body
+
+async def serve(host, port, workers, max_sessions, idle_timeout, book_path = None, database_path = None):
+    server = GameServer(workers, max_sessions, idle_timeout, book_path, database_path)
+    await server.start(host, port)
+    print("serving on http://" + host + ":" + str(port) + " with " + str(server.workers) + " workers", flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API for the frontend, backed by Board.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="engine worker processes, 0 to run engine work inline")
+    parser.add_argument("--max-sessions", type=int, default=10000,
+                        help="sessions kept at once (a count, not a memory size; each holds at most "
+                             + str(MAX_PLIES) + " plies)")
+    parser.add_argument("--idle-timeout", type=float, default=600.0, help="seconds before an unused session is dropped")
+    parser.add_argument("--book", help="opening book for /api/engine-move (see book.py)")
+    parser.add_argument("--games", help="game database directory for /api/position-games (see gamedb.py)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_sessions, args.idle_timeout, args.book,
+                          args.games))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
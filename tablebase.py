@@ -0,0 +1,289 @@
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+
+from board import BLACK, EMPTY, KING, PAWN, QUEEN, ROOK, SQUARES, Board, move_to_uci
+
+# Tables cover a king and one piece against a bare king. Squares are row * 8 + col (row 0 is the
+# 8th rank, as on the board) and the strong side is always white; probing a position where black
+# has the piece mirrors it first. One byte per position, indexed by
+# ((side_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece, side_to_move 0 = strong side.
+# Byte values: 0 draw, 1..127 side to move mates in that many plies, 128 + n side to move is mated
+# in n plies (128 is checkmate), 255 illegal position.
+TABLES = {'KQK': QUEEN, 'KRK': ROOK, 'KPK': PAWN}
+ENTRIES = 2 * 64 * 64 * 64
+WEAK = 64 * 64 * 64 # offset of the weak-side-to-move half
+LOSS = 128
+ILLEGAL = 255
+MAGIC = b'PYCTB001'
+
+def _step(s, dr, dc):
+    row = (s >> 3) + dr
+    col = (s & 7) + dc
+    return row * 8 + col if 0 <= row < 8 and 0 <= col < 8 else -1
+
+KING_DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+KING_STEPS = [[t for t in (_step(s, dr, dc) for dr, dc in KING_DIRECTIONS) if t >= 0] for s in range(64)]
+NEAR = bytearray(64 * 64) # kings on a and b touch (or a == b)
+for _a in range(64):
+    NEAR[_a * 64 + _a] = 1
+    for _b in KING_STEPS[_a]:
+        NEAR[_a * 64 + _b] = 1
+
+# RAYS[s][d]: squares from s outwards in KING_DIRECTIONS[d]. LINE[a * 64 + b]: 1 when a and b share
+# a rank or file, 2 a diagonal; BETWEEN[a * 64 + b]: bitmask of the squares strictly between them.
+RAYS = []
+LINE = bytearray(64 * 64)
+BETWEEN = [0] * (64 * 64)
+for _a in range(64):
+    _rays = []
+    for _dr, _dc in KING_DIRECTIONS:
+        _ray = []
+        _s = _step(_a, _dr, _dc)
+        _mask = 0
+        while _s >= 0:
+            _ray.append(_s)
+            LINE[_a * 64 + _s] = 2 if _dr and _dc else 1
+            BETWEEN[_a * 64 + _s] = _mask
+            _mask |= 1 << _s
+            _s = _step(_s, _dr, _dc)
+        _rays.append(_ray)
+    RAYS.append(_rays)
+PIECE_RAYS = {QUEEN: range(8), ROOK: tuple(KING_DIRECTIONS.index(d) for d in ROOK_DIRECTIONS), PAWN: ()}
+
+def attacks(kind, piece, target, blocker):
+    #does the white piece on piece attack target, with blocker the only other piece in the way
+    if kind == PAWN:
+        return piece >> 3 == (target >> 3) + 1 and abs((piece & 7) - (target & 7)) == 1
+    line = LINE[piece * 64 + target]
+    if not line or (kind == ROOK and line != 1):
+        return False
+    return not BETWEEN[piece * 64 + target] >> blocker & 1
+
+def legal(kind, strong_to_move, strong_king, weak_king, piece):
+    if piece == strong_king or piece == weak_king or NEAR[strong_king * 64 + weak_king]:
+        return False
+    if kind == PAWN and (piece >> 3 == 0 or piece >> 3 == 7):
+        return False
+    return not (strong_to_move and attacks(kind, piece, weak_king, strong_king))
+
+def weak_moves(kind, strong_king, weak_king, piece):
+    #(target square, captures the piece) for every legal move of the bare king
+    moves = []
+    for target in KING_STEPS[weak_king]:
+        if NEAR[target * 64 + strong_king]:
+            continue
+        if target == piece:
+            moves.append((target, True))
+        elif not attacks(kind, piece, target, strong_king):
+            moves.append((target, False))
+    return moves
+
+def strong_unmoves(kind, index):
+    #strong-to-move positions from which a strong move reaches the weak-to-move position index
+    index -= WEAK
+    strong_king = index >> 12
+    weak_king = index >> 6 & 63
+    piece = index & 63
+    previous = []
+    for square in KING_STEPS[strong_king]:
+        if square != piece and not NEAR[square * 64 + weak_king]:
+            previous.append((square, piece))
+    if kind == PAWN:
+        square = piece + 8
+        if square >> 3 <= 6 and square != strong_king and square != weak_king:
+            previous.append((strong_king, square))
+            if piece >> 3 == 4 and square + 8 != strong_king and square + 8 != weak_king:
+                previous.append((strong_king, square + 8))
+    else:
+        for direction in PIECE_RAYS[kind]:
+            for square in RAYS[piece][direction]:
+                if square == strong_king or square == weak_king:
+                    break
+                previous.append((strong_king, square))
+    return [(king << 6 | weak_king) << 6 | square for king, square in previous
+            if legal(kind, True, king, weak_king, square)]
+
+def weak_unmoves(index):
+    #weak-to-move positions from which a bare king move reaches the strong-to-move position index
+    strong_king = index >> 12
+    weak_king = index >> 6 & 63
+    piece = index & 63
+    return [WEAK + ((strong_king << 6 | square) << 6 | piece) for square in KING_STEPS[weak_king]
+            if square != piece and not NEAR[square * 64 + strong_king]]
+
+def generate(name, directory = 'tablebases'):
+    #Retrograde analysis of one table: checkmates first, then alternately every strong-to-move
+    #position with a move into a position lost at the current distance, and every weak-to-move
+    #position whose last unresolved move just became a loss. KPK promotions are looked up in the
+    #KQK and KRK tables, which must have been generated already. Returns (wins, draws, losses).
+    kind = TABLES[name]
+    values = bytearray(ENTRIES)
+    counts = bytearray(WEAK)
+    losses = []
+    for index in range(ENTRIES):
+        strong_to_move = index < WEAK
+        strong_king = index >> 12 & 63
+        weak_king = index >> 6 & 63
+        piece = index & 63
+        if not legal(kind, strong_to_move, strong_king, weak_king, piece):
+            values[index] = ILLEGAL
+        elif not strong_to_move:
+            counts[index - WEAK] = len(weak_moves(kind, strong_king, weak_king, piece))
+            if not counts[index - WEAK] and attacks(kind, piece, weak_king, strong_king):
+                values[index] = LOSS
+                losses.append(index)
+
+    #promotions: strong-to-move positions winning through a promotion, keyed by distance
+    promotions = {}
+    if kind == PAWN:
+        queen = Tablebase(directory).table('KQK')
+        rook = Tablebase(directory).table('KRK')
+        for index in range(WEAK):
+            piece = index & 63
+            if values[index] != ILLEGAL and piece >> 3 == 1:
+                square = piece - 8
+                child = WEAK + (index & ~63 | square)
+                if square != index >> 12 and square != index >> 6 & 63:
+                    results = [table[child] - LOSS for table in (queen, rook) if LOSS <= table[child] < ILLEGAL]
+                    if results:
+                        promotions.setdefault(min(results) + 1, []).append(index)
+
+    plies = 0
+    while losses or any(distance > plies for distance in promotions):
+        wins = []
+        for lost in losses:
+            for index in strong_unmoves(kind, lost):
+                if not values[index]:
+                    values[index] = plies + 1
+                    wins.append(index)
+        for index in promotions.pop(plies + 1, ()):
+            if not values[index]:
+                values[index] = plies + 1
+                wins.append(index)
+        losses = []
+        for won in wins:
+            for index in weak_unmoves(won):
+                if not values[index]:
+                    counts[index - WEAK] -= 1
+                    if not counts[index - WEAK]:
+                        values[index] = LOSS + plies + 2
+                        losses.append(index)
+        plies += 2
+        if plies >= LOSS - 1:
+            raise ValueError(name + " distances do not fit in a byte")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.bin')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(values)
+    os.replace(path + '.tmp', path)
+    wins = sum(1 for value in values if 0 < value < LOSS)
+    losses = sum(1 for value in values if LOSS <= value < ILLEGAL)
+    return wins, values.count(0), losses
+
+class Tablebase:
+    #Probes the table files of a directory, each opened with mmap on first use.
+    def __init__(self, directory = 'tablebases'):
+        self.directory = directory
+        self.tables = {}
+
+    def table(self, name):
+        #the mapped values of a table (indexable like a bytes object), or None if there is no file
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + '.bin')
+            table = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if data[:len(MAGIC)] != MAGIC:
+                    raise ValueError(path + " is not a tablebase file")
+                table = memoryview(data)[len(MAGIC):]
+            self.tables[name] = table
+        return self.tables[name]
+
+    def probe(self, board):
+        #(wdl, plies) for the side to move: wdl 1 win, 0 draw, -1 loss, plies to mate; None when the
+        #material is not covered, a table is missing or castling rights are still set
+        if board.castling:
+            return None
+        squares = board.squares
+        piece = None
+        for sq in SQUARES:
+            code = squares[sq]
+            if code != EMPTY and code & 7 != KING:
+                if piece is not None:
+                    return None
+                piece = sq
+        if piece is None:
+            return 0, 0
+        code = squares[piece]
+        name = 'K' + 'PNBRQ'[(code & 7) - 1] + 'K'
+        table = self.table(name) if name in TABLES else None
+        if table is None:
+            return None
+        white = not code & BLACK
+        strong_king = board.king_squares[0 if white else 1]
+        weak_king = board.king_squares[1 if white else 0]
+        flip = 0 if white else 56 #mirror the ranks so the strong side plays up the board as white
+        index = (((strong_king >> 4) * 8 + (strong_king & 7)) ^ flip) << 12
+        index |= (((weak_king >> 4) * 8 + (weak_king & 7)) ^ flip) << 6
+        index |= ((piece >> 4) * 8 + (piece & 7)) ^ flip
+        if board.white_to_play != white:
+            index += WEAK
+        value = table[index]
+        if value == ILLEGAL:
+            return None
+        if value >= LOSS:
+            return -1, value - LOSS
+        return (1, value) if value else (0, 0)
+
+    def best_move(self, board):
+        #(move, wdl, plies) of the fastest win, a draw, or the longest resistance; None if not covered
+        if self.probe(board) is None:
+            return None
+        best = None
+        for move in board.legal_moves():
+            board.make_move(move)
+            result = self.probe(board)
+            board.unmake_move()
+            if result is None:
+                continue
+            wdl, plies = -result[0], result[1] + 1
+            rank = (wdl, -plies if wdl > 0 else plies)
+            if best is None or rank > best[0]:
+                best = (rank, move, wdl, plies)
+        return best and best[1:]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or probe king and piece against king tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate")
+    generate_parser.add_argument("tables", nargs="*", default=list(TABLES))
+    generate_parser.add_argument("--directory", default="tablebases")
+    probe_parser = commands.add_parser("probe")
+    probe_parser.add_argument("fen")
+    probe_parser.add_argument("--directory", default="tablebases")
+    args = parser.parse_args()
+    if args.command == "generate":
+        for name in args.tables:
+            start = time.perf_counter()
+            wins, draws, losses = generate(name, args.directory)
+            print(json.dumps({'table': name, 'wins': wins, 'draws': draws, 'losses': losses,
+                              'seconds': round(time.perf_counter() - start, 2)}), flush=True)
+    else:
+        tablebase = Tablebase(args.directory)
+        board = Board(args.fen)
+        result = tablebase.probe(board)
+        best = tablebase.best_move(board)
+        print(json.dumps({'wdl': result and result[0], 'plies': result and result[1],
+                          'best_move': best and move_to_uci(best[0])}))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,160 @@
-class Test:
-
-    def func(self):
-        var = []
-        var.append(1)
-        print(var)
-
-test = Test()
-test.func()
-test.func()
-test.func()
-test.func()
-test.func()
-test.func()
-test.func()
+import random
+import shutil
+import tempfile
+import unittest
+
+from board import Board
+from evaluation import encode, evaluate, evaluate_batch, np
+from history import GameHistory
+from perft import SUITE, divide, perft
+from tablebase import TABLES, Tablebase, generate
+
+# Randomized consistency checks: every fast path against the plain computation it replaces.
+# Run with python test.py (or python -m pytest test.py).
+
+def random_positions(rng, fen, plies):
+    #yields the board after each random legal move of one game from fen
+    board = Board(fen)
+    for _ in range(plies):
+        moves = board.legal_moves()
+        if not moves:
+            break
+        board.make_move(rng.choice(moves))
+        yield board
+
+class PerftTest(unittest.TestCase):
+    def test_reference_counts(self):
+        for name, fen, counts in SUITE:
+            board = Board(fen)
+            for depth in range(1, 4):
+                self.assertEqual(perft(board, depth), counts[depth - 1], name + " depth " + str(depth))
+            self.assertEqual(board.fen, fen, name)
+
+    def test_divide_sums_to_perft(self):
+        for name, fen, counts in SUITE:
+            board = Board(fen)
+            split = divide(board, 2)
+            self.assertEqual(len(split), counts[0], name)
+            self.assertEqual(sum(split.values()), counts[1], name)
+            self.assertEqual(board.fen, fen, name)
+
+class EvaluationTest(unittest.TestCase):
+    @unittest.skipIf(np is None, "batch evaluation needs numpy")
+    def test_batch_matches_scalar(self):
+        rng = random.Random(13)
+        for _, fen, _ in SUITE:
+            boards = [Board(board.fen) for board in random_positions(rng, fen, 80)]
+            scores = evaluate_batch(*encode(boards))
+            self.assertEqual(list(scores), [evaluate(board) for board in boards])
+
+class IncrementalStateTest(unittest.TestCase):
+    def test_make_and_unmake_match_recompute(self):
+        rng = random.Random(14)
+        for _, fen, _ in SUITE:
+            for _ in range(10):
+                board = None
+                for board in random_positions(rng, fen, 120):
+                    self.assertEqual(board.zobrist_key, board._compute_key(), board.fen)
+                    self.assertEqual(board._eval, board._compute_eval(), board.fen)
+                    self.assertEqual(board.evaluate(), evaluate(board), board.fen)
+                    self.assertEqual(Board(board.fen).zobrist_key, board.zobrist_key, board.fen)
+                if board is None:
+                    continue
+                while board._undo_stack:
+                    board.unmake_move()
+                start = Board(fen)
+                self.assertEqual((board.fen, board.zobrist_key, board._eval), (start.fen, start.zobrist_key, start._eval))
+
+class TablebaseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        for name in ('KQK', 'KRK', 'KPK'): #KPK promotes into the other two
+            generate(name, cls.directory)
+        cls.tablebase = Tablebase(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_values_match_one_ply_minimax(self):
+        rng = random.Random(18)
+        for name in TABLES:
+            checked = 0
+            while checked < 500:
+                board = Board(random_fen(rng, name))
+                result = self.tablebase.probe(board)
+                if result is None:
+                    continue #an illegal placement
+                best = None
+                for move in board.legal_moves():
+                    board.make_move(move)
+                    child = self.tablebase.probe(board) or (0, 0) #KBK and KNK are not tabled: drawn
+                    board.unmake_move()
+                    wdl, plies = -child[0], child[1] + 1
+                    rank = (wdl, -plies if wdl > 0 else plies)
+                    if best is None or rank > best[0]:
+                        best = (rank, (wdl, plies if wdl else 0))
+                if best is None:
+                    expected = (-1, 0) if board.is_check() else (0, 0)
+                else:
+                    expected = best[1]
+                self.assertEqual(result, expected, board.fen)
+                checked += 1
+
+class GameHistoryTest(unittest.TestCase):
+    def test_navigation_truncation_and_round_trip(self):
+        rng = random.Random(21)
+        for _ in range(20):
+            history = GameHistory(checkpoint_every=rng.choice((1, 3, 8, 32)))
+            fens = [history.board.fen]
+            for _ in range(rng.randrange(10, 200)):
+                moves = history.board.legal_moves()
+                if not moves:
+                    break
+                history.play(rng.choice(moves))
+                fens.append(history.board.fen)
+            self.assertEqual(history.board.fen, fens[-1])
+            for _ in range(200):
+                step = rng.random()
+                if step < 0.4:
+                    history.back()
+                elif step < 0.8:
+                    history.forward()
+                else:
+                    history.seek(rng.randrange(-3, len(history) + 4))
+                self.assertEqual(history.board.fen, fens[history.ply])
+            #playing from the middle drops the rest of the game
+            history.seek(len(history) // 2)
+            cut = history.ply
+            moves = history.board.legal_moves()
+            if moves:
+                history.play(moves[0])
+                board = Board(fens[cut])
+                board.make_move(moves[0])
+                fens[cut + 1:] = [board.fen]
+                self.assertEqual(len(history), cut + 1)
+                history.seek(0)
+                history.seek(len(history))
+                self.assertEqual(history.board.fen, fens[-1])
+            data = history.to_bytes()
+            copy = GameHistory.from_bytes(data)
+            self.assertEqual(copy.move_list(), history.move_list())
+            self.assertEqual(copy.board.fen, fens[-1])
+            with self.assertRaises(ValueError):
+                GameHistory.from_bytes(data[:-1])
+
+def random_fen(rng, name):
+    #kings and the extra piece of a table on random distinct squares, either side strong and to move
+    rows = [['1'] * 8 for _ in range(8)]
+    strong = rng.random() < 0.5
+    pieces = ['K', 'k', name[1] if strong else name[1].lower()]
+    for piece, square in zip(pieces, rng.sample(range(64), 3)):
+        rows[square >> 3][square & 7] = piece
+    placement = '/'.join(''.join(row) for row in rows)
+    for count in range(8, 1, -1):
+        placement = placement.replace('1' * count, str(count))
+    return placement + (' w' if rng.random() < 0.5 else ' b') + ' - - 0 1'
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+from array import array
+
+# bound types
+EXACT = 1
+LOWER = 2 # score is at least the stored value (fail high)
+UPPER = 3 # score is at most the stored value (fail low)
+
+ENTRY_BYTES = 16 # one 64-bit key plus one packed 64-bit data word
+
+# data word layout: move (20 bits) | depth (8) | bound (2) | age (8) | score + SCORE_OFFSET (22)
+MOVE_MASK = (1 << 20) - 1
+DEPTH_SHIFT = 20
+BOUND_SHIFT = 28
+AGE_SHIFT = 30
+SCORE_SHIFT = 38
+SCORE_OFFSET = 1 << 21
+
+class TranspositionTable:
+    #Fixed-size table of (Zobrist key, packed entry) pairs in two flat arrays. The slot count is the
+    #largest power of two that fits in the memory cap, so memory use never grows after construction.
+    #A slot is overwritten when it is empty, holds the same position, was written by an older
+    #search (see new_search) or holds a result searched no deeper than the new one.
+    def __init__(self, mb = 16):
+        slots = 1
+        while slots * 2 * ENTRY_BYTES <= mb * 1024 * 1024:
+            slots *= 2
+        self.size = slots
+        self.mask = slots - 1
+        self.keys = array('Q', bytes(8 * slots))
+        self.data = array('Q', bytes(8 * slots))
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        self.age = (self.age + 1) & 0xff
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.data = array('Q', bytes(8 * self.size))
+        self.age = 0
+        self.hits = self.misses = self.collisions = self.stores = self.overwrites = 0
+
+    def probe(self, key):
+        #(depth, score, bound, move) for key, or None
+        index = key & self.mask
+        stored = self.keys[index]
+        if stored == key and self.data[index]:
+            self.hits += 1
+            data = self.data[index]
+            return ((data >> DEPTH_SHIFT) & 0xff, (data >> SCORE_SHIFT) - SCORE_OFFSET,
+                    (data >> BOUND_SHIFT) & 3, data & MOVE_MASK)
+        if stored:
+            self.collisions += 1
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        index = key & self.mask
+        old = self.data[index]
+        if old and self.keys[index] != key:
+            if (old >> AGE_SHIFT) & 0xff == self.age and (old >> DEPTH_SHIFT) & 0xff > depth:
+                return
+            self.overwrites += 1
+        elif old and not move:
+            move = old & MOVE_MASK #keep the best move of a previous search of this position
+        self.keys[index] = key
+        self.data[index] = (move & MOVE_MASK | min(depth, 0xff) << DEPTH_SHIFT | bound << BOUND_SHIFT
+                            | self.age << AGE_SHIFT | (score + SCORE_OFFSET) << SCORE_SHIFT)
+        self.stores += 1
+
+    def memory_bytes(self):
+        return self.size * ENTRY_BYTES
+
+    def hashfull(self):
+        #permille of the first 1000 slots written by the current search
+        sample = min(1000, self.size)
+        used = 0
+        for index in range(sample):
+            data = self.data[index]
+            if data and (data >> AGE_SHIFT) & 0xff == self.age:
+                used += 1
+        return used * 1000 // sample
+
+    def stats(self):
+        return {'size': self.size, 'bytes': self.memory_bytes(), 'hits': self.hits, 'misses': self.misses,
+                'collisions': self.collisions, 'stores': self.stores, 'overwrites': self.overwrites,
+                'hashfull': self.hashfull()}